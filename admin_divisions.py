@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+行政区划索引与地名结果规范化：补全通名、补齐上级行政区、纠正层级错位，只把与索引确实矛盾的地名标记出来。
+省级名称内置；地级/县级数据从 ADMIN_DIVISIONS_FILE（JSON: {省: {市: [县, ...]}}）预加载。
+仓库附带的 admin_divisions.json 由 GB/T 2260 区划代码表生成（cpca 的 resources/adcodes.csv，MIT 许可）：
+    python admin_divisions.py adcodes.csv -o admin_divisions.json
+数据文件缺失时只补全省级通名、纠正"省写进市"（仅全称），其余值视为无法核实而原样保留。
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from config import ADMIN_DIVISIONS_FILE
+except ImportError:
+    ADMIN_DIVISIONS_FILE = os.getenv("ADMIN_DIVISIONS_FILE", "admin_divisions.json")
+
+logger = logging.getLogger(__name__)
+
+PLACE_FIELDS = ("name", "modern_name", "country", "province", "city", "county")
+
+PROVINCES = (
+    "北京市", "天津市", "上海市", "重庆市",
+    "河北省", "山西省", "辽宁省", "吉林省", "黑龙江省", "江苏省", "浙江省", "安徽省",
+    "福建省", "江西省", "山东省", "河南省", "湖北省", "湖南省", "广东省", "海南省",
+    "四川省", "贵州省", "云南省", "陕西省", "甘肃省", "青海省", "台湾省",
+    "内蒙古自治区", "广西壮族自治区", "西藏自治区", "宁夏回族自治区", "新疆维吾尔自治区",
+    "香港特别行政区", "澳门特别行政区",
+)
+# 直辖市：按提示词约定写在 province，city 留空，区写在 county
+MUNICIPALITIES = frozenset(("北京市", "天津市", "上海市", "重庆市"))
+
+# 通名后缀（长的在前，保证"壮族自治区"先于"自治区"匹配）
+_PROVINCE_SUFFIXES = ("壮族自治区", "回族自治区", "维吾尔自治区", "特别行政区", "自治区", "省", "市")
+_CITY_SUFFIXES = ("自治州", "地区", "市", "盟")
+_COUNTY_SUFFIXES = ("自治县", "自治旗", "林区", "特区", "县", "区", "市", "旗")
+
+# 区划代码表中不是真实地级单位的占位名称（直辖市下的"市辖区"/"县"、省直辖县级单位的分组）
+_PSEUDO_CITIES = frozenset(("市辖区", "县", "省直辖县级行政区划", "自治区直辖县级行政区划"))
+
+# 模型用来表示"未知"的占位文本，一律视为 null
+_UNKNOWN_VALUES = frozenset(("", "未知", "不确定", "不详", "无", "null", "none", "n/a", "-"))
+_CHINA = frozenset(("中国", "中华人民共和国"))
+
+
+def _short_name(full: str, suffixes: Tuple[str, ...]) -> str:
+    for suffix in suffixes:
+        if full.endswith(suffix) and len(full) - len(suffix) >= 2:
+            return full[: -len(suffix)]
+    return full
+
+
+def clean_value(value: Any) -> Optional[str]:
+    """去空白；未知占位文本与非字符串空值返回 None。"""
+    if value is None:
+        return None
+    text = str(value).strip()
+    if text.lower() in _UNKNOWN_VALUES:
+        return None
+    return text
+
+
+class AdminDivisionIndex:
+    """省 → 市 → 县 三级索引，加载时预先算好简称到全称的映射。"""
+
+    def __init__(self, tree: Dict[str, Dict[str, List[str]]] = None):
+        self.provinces = set(PROVINCES)
+        self.city_parent: Dict[str, set] = {}  # 市全称 -> {省}
+        self.county_parents: Dict[str, set] = {}  # 县全称 -> {(省, 市或None)}
+        self.children: Dict[Tuple[str, Optional[str]], set] = {}  # (省, 市) -> {县}
+        for province, cities in (tree or {}).items():
+            self.provinces.add(province)
+            for city, counties in (cities or {}).items():
+                # 直辖市下的区直接挂在省级下
+                city = None if (province in MUNICIPALITIES or not city or city == province) else city
+                if city:
+                    self.city_parent.setdefault(city, set()).add(province)
+                bucket = self.children.setdefault((province, city), set())
+                for county in counties or []:
+                    bucket.add(county)
+                    self.county_parents.setdefault(county, set()).add((province, city))
+        self.province_alias = self._aliases(self.provinces, _PROVINCE_SUFFIXES)
+        self.city_alias = self._aliases(self.city_parent, _CITY_SUFFIXES)
+        self.county_alias = self._aliases(self.county_parents, _COUNTY_SUFFIXES)
+
+    @staticmethod
+    def _aliases(names, suffixes) -> Dict[str, set]:
+        alias: Dict[str, set] = {}
+        for full in names:
+            alias.setdefault(full, set()).add(full)
+            alias.setdefault(_short_name(full, suffixes), set()).add(full)
+        return alias
+
+    @property
+    def has_cities(self) -> bool:
+        return bool(self.city_parent)
+
+    @staticmethod
+    def _resolve(alias: Dict[str, set], value: Optional[str], candidates=None) -> Optional[str]:
+        """简称/全称 -> 唯一全称；candidates 给定时只在其中选；有歧义或未知时返回 None。"""
+        if not value:
+            return None
+        fulls = alias.get(value)
+        if fulls is None:
+            return None
+        if candidates is not None:
+            fulls = fulls & candidates
+        return next(iter(fulls)) if len(fulls) == 1 else None
+
+    def resolve_province(self, value):
+        return self._resolve(self.province_alias, value)
+
+    def resolve_city(self, value, province=None):
+        if province:
+            candidates = {c for c, ps in self.city_parent.items() if province in ps}
+            return self._resolve(self.city_alias, value, candidates)
+        return self._resolve(self.city_alias, value)
+
+
+def build_tree_from_adcodes(rows: Iterable[Tuple[str, str]]) -> Dict[str, Dict[str, List[str]]]:
+    """
+    GB/T 2260 区划代码 (adcode, name) -> {省: {市: [县, ...]}}，按代码顺序。
+    adcode 取前 6 位（兼容 12 位统计用代码）；直辖市与省直辖县级单位的"市"记为 ""。
+    """
+    names: Dict[str, str] = {}
+    for code, name in rows:
+        code, name = str(code).strip()[:6], str(name).strip()
+        if len(code) == 6 and code.isdigit() and name:
+            names[code] = name
+    tree: Dict[str, Dict[str, List[str]]] = {}
+    for code in sorted(names):
+        province = names.get(code[:2] + "0000")
+        if province is None:
+            continue
+        cities = tree.setdefault(province, {})
+        if code.endswith("0000"):
+            continue
+        city = names.get(code[:4] + "00", "")
+        if city in _PSEUDO_CITIES or province in MUNICIPALITIES:
+            city = ""
+        counties = cities.setdefault(city, [])
+        if not code.endswith("00") and names[code] not in _PSEUDO_CITIES:
+            counties.append(names[code])
+    for cities in tree.values():
+        if not cities.get("", True):
+            del cities[""]
+    return tree
+
+
+def _data_path(path: str) -> str:
+    """相对路径先按当前目录找，找不到再按本模块所在目录找（仓库附带的数据文件）。"""
+    if not path or os.path.isabs(path) or os.path.exists(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+
+
+@lru_cache(maxsize=1)
+def get_admin_index() -> AdminDivisionIndex:
+    """预加载行政区划索引（进程内只加载一次）；数据文件不存在时只含内置省级名称。"""
+    tree = None
+    path = _data_path(ADMIN_DIVISIONS_FILE)
+    if path and os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                tree = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("行政区划数据加载失败，只做省级校验: %s (%s)", path, e)
+    else:
+        logger.warning("行政区划数据不存在，只做省级校验: %s", ADMIN_DIVISIONS_FILE)
+    return AdminDivisionIndex(tree)
+
+
+@lru_cache(maxsize=65536)
+def canonicalize_admin(
+    province: Optional[str], city: Optional[str], county: Optional[str]
+) -> Tuple[Optional[str], Optional[str], Optional[str], Tuple[str, ...]]:
+    """
+    规范化一组 (省, 市, 县)，按输入缓存结果。
+    返回: (province, city, county, conflicts)。conflicts 为与索引确实矛盾的字段名（这些字段已置为 None），
+    为空表示有效；索引中查不到（无法核实）的值原样保留，不算矛盾。
+    """
+    index = get_admin_index()
+
+    # 层级错位：省写进了市（含直辖市写在 city 的情况）；没有地级数据时只认全称，
+    # 否则"吉林"、"海南"这类与省同名的市会被误当成省
+    moved = index.resolve_province(city) if city and not index.resolve_city(city) else None
+    if moved and (index.has_cities or city == moved):
+        if province and index.resolve_province(province) not in (None, moved):
+            return None, None, county, ("province", "city")
+        province, city = moved, None
+    # 层级错位：市写进了省（需要地级数据才能识别）
+    if province and not index.resolve_province(province) and index.resolve_city(province):
+        if city and index.resolve_city(city) != index.resolve_city(province):
+            return None, None, county, ("province", "city")
+        province, city = None, province
+
+    if province:
+        full = index.resolve_province(province)
+        if full is not None:
+            province = full
+        elif index.has_cities:
+            # 有完整数据时，既不是省也不是市的"省"才确定无效
+            return None, city, county, ("province",)
+    if province in MUNICIPALITIES and city:
+        # 直辖市下的区被写在 city
+        if not county:
+            county = city
+        city = None
+
+    conflicts: List[str] = []
+    if city and index.has_cities:
+        fulls = index.city_alias.get(city, set())
+        matches = {c for c in fulls if not province or province in index.city_parent[c]}
+        if fulls and not matches:
+            conflicts.append("city")  # 市存在，但不属于该省
+            city = None
+        elif len(matches) == 1:
+            city = next(iter(matches))
+            if not province:
+                parents = index.city_parent[city]
+                province = next(iter(parents)) if len(parents) == 1 else None
+
+    if county and index.has_cities:
+        fulls = index.county_alias.get(county, set())
+        pairs = {
+            (full, parent)
+            for full in fulls
+            for parent in index.county_parents[full]
+            if (not province or parent[0] == province) and (not city or parent[1] == city)
+        }
+        if fulls and not pairs:
+            conflicts.append("county")  # 县存在，但不属于给定的省/市
+            county = None
+        elif pairs:
+            if len({full for full, _ in pairs}) == 1:
+                county = next(iter(pairs))[0]
+            if len(pairs) == 1:
+                p_full, c_full = next(iter(pairs))[1]
+                province = province or p_full
+                city = city or c_full
+    return province, city, county, tuple(conflicts)
+
+
+def canonicalize_place(place: Any) -> Tuple[Optional[Dict[str, Any]], Tuple[str, ...]]:
+    """
+    规范化单个地名条目：补齐字段、未知文本置 null、修正行政区层级与通名。
+    返回: (place_dict | None, conflicts)；矛盾的行政区字段已置 null，name / modern_name 保留；
+    缺少 name 或不是对象的条目返回 (None, ("name",))。
+    """
+    if not isinstance(place, dict):
+        return None, ("name",)
+    out = {k: clean_value(place.get(k)) for k in PLACE_FIELDS}
+    if not out["name"]:
+        return None, ("name",)
+    if out["country"] and out["country"] not in _CHINA:
+        return out, ()  # 境外地名不做行政区校验
+    province, city, county, conflicts = canonicalize_admin(out["province"], out["city"], out["county"])
+    out["province"], out["city"], out["county"] = province, city, county
+    if (province or city or county) and not out["country"]:
+        out["country"] = "中国"
+    return out, conflicts
+
+
+def canonicalize_places(places: List[Any]) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    规范化 places 列表，返回 (规范化后的条目, 含矛盾的条目数)。
+    含矛盾的条目保留（矛盾字段已置 null），只有缺少 name 的条目被丢弃。
+    """
+    out_places: List[Dict[str, Any]] = []
+    invalid = 0
+    for place in places:
+        out, conflicts = canonicalize_place(place)
+        if conflicts:
+            invalid += 1
+        if out is not None:
+            out_places.append(out)
+    return out_places, invalid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="由 GB/T 2260 区划代码表（CSV: adcode,name,...）生成行政区划数据")
+    parser.add_argument("adcodes_csv", help="区划代码 CSV，如 cpca 的 resources/adcodes.csv")
+    parser.add_argument("-o", "--output", default=ADMIN_DIVISIONS_FILE)
+    args = parser.parse_args()
+
+    with open(args.adcodes_csv, encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        rows = [(r[0], r[1]) for r in reader if len(r) >= 2]
+    tree = build_tree_from_adcodes(rows)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(tree, f, ensure_ascii=False, indent=1)
+        f.write("\n")
+    counties = sum(len(c) for cities in tree.values() for c in cities.values())
+    cities = sum(1 for cities in tree.values() for c in cities if c)
+    print(f"已写入 {args.output}: {len(tree)} 个省级, {cities} 个地级, {counties} 个县级")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+启动耗时基准：在独立子进程中冷导入 worker，统计导入耗时并检查重型依赖是否被提前加载；
+另测热路径上 LLMChat 构造与配置读取的单次开销。
+用法: python bench_startup.py [--runs 10]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+# 冷启动阶段不应被导入的模块（只在领到任务 / 首次调用对应平台时才需要）
+LAZY_MODULES = ("openai", "pymysql", "requests", "urllib3")
+
+_PROBE = """
+import sys, time
+t0 = time.perf_counter()
+import worker
+elapsed = time.perf_counter() - t0
+loaded = [m for m in {lazy!r} if m in sys.modules]
+print(elapsed)
+print(",".join(loaded))
+"""
+
+
+def bench_cold_import(runs: int):
+    timings = []
+    loaded = set()
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(lazy=LAZY_MODULES)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.splitlines()
+        timings.append(float(out[0]))
+        if len(out) > 1 and out[1]:
+            loaded.update(out[1].split(","))
+    return timings, sorted(loaded)
+
+
+def bench_hot_path(number: int = 100000):
+    from llm_chat import LLMChat, get_llm_settings
+
+    settings = get_llm_settings()
+    LLMChat(settings)
+    per_settings = timeit.timeit(get_llm_settings, number=number) / number
+    per_chat = timeit.timeit(lambda: LLMChat(settings), number=number) / number
+    return per_settings, per_chat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="worker 冷启动与热路径开销基准")
+    parser.add_argument("--runs", type=int, default=10, help="冷导入重复次数")
+    args = parser.parse_args()
+
+    timings, loaded = bench_cold_import(args.runs)
+    print(f"冷导入 worker: 中位数 {statistics.median(timings) * 1000:.1f} ms, "
+          f"最小 {min(timings) * 1000:.1f} ms, 最大 {max(timings) * 1000:.1f} ms ({args.runs} 次)")
+    print(f"冷启动时已加载的延迟依赖: {', '.join(loaded) if loaded else '无'}")
+
+    t0 = time.perf_counter()
+    per_settings, per_chat = bench_hot_path()
+    print(f"get_llm_settings(): {per_settings * 1e9:.0f} ns/次")
+    print(f"LLMChat(settings): {per_chat * 1e9:.0f} ns/次")
+    print(f"热路径测试耗时 {time.perf_counter() - t0:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Token 预算调控：按 ask_once_with_usage 返回的 usage 统计单任务与最近一小时的 token 用量，
+接近预算时减速派发并切换到便宜模型，超出每小时预算时暂停派发直到窗口释放。
+单任务预算用尽后不丢弃剩余诗歌，继续按减速与便宜模型派发，直到任务完成。
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+try:
+    from config import (
+        TOKEN_BUDGET_PER_TASK,
+        TOKEN_BUDGET_PER_HOUR,
+        BUDGET_SOFT_RATIO,
+        BUDGET_THROTTLE_SECONDS,
+        BUDGET_FALLBACK_MODEL,
+    )
+except ImportError:
+    TOKEN_BUDGET_PER_TASK = 0
+    TOKEN_BUDGET_PER_HOUR = 0
+    BUDGET_SOFT_RATIO = 0.8
+    BUDGET_THROTTLE_SECONDS = 2.0
+    BUDGET_FALLBACK_MODEL = ""
+
+logger = logging.getLogger(__name__)
+
+HOUR_SECONDS = 3600
+# 每小时预算耗尽时单次最长等待（秒），之后重新检查窗口
+MAX_PAUSE_SLICE = 30
+
+
+class BudgetGovernor:
+    """
+    线程安全的 token 预算调控器，进程内所有批次线程共用一个实例。预算 ≤0 表示不限制。
+    状态: ok（正常）/ throttle（用量达到 soft_ratio，所有线程共用一个派发时间表，相邻请求至少间隔
+    throttle_seconds，并改用 fallback_model；单任务用量超出预算后仍保持此状态）/
+    paused（每小时预算已用尽，等待一小时窗口内的旧用量过期）。
+    """
+
+    def __init__(
+        self,
+        task_budget: int = 0,
+        hourly_budget: int = 0,
+        soft_ratio: float = 0.8,
+        throttle_seconds: float = 2.0,
+        fallback_model: str = "",
+    ):
+        self.task_budget = task_budget
+        self.hourly_budget = hourly_budget
+        self.soft_ratio = soft_ratio
+        self.throttle_seconds = throttle_seconds
+        self.fallback_model = fallback_model
+        self._lock = threading.Lock()
+        self._hour = deque()  # (monotonic 时间, tokens)
+        self._hour_tokens = 0
+        self._task_id = None
+        self._task_tokens = 0
+        self._state = "ok"
+        self._next_slot = 0.0  # throttle 状态下下一个可派发请求的 monotonic 时间
+        self.metrics: Dict[str, Any] = {
+            "requests": 0,
+            "tokens": 0,
+            "throttled_requests": 0,
+            "throttle_seconds": 0.0,
+            "fallback_requests": 0,
+        }
+
+    @classmethod
+    def from_config(cls) -> "BudgetGovernor":
+        return cls(
+            task_budget=TOKEN_BUDGET_PER_TASK,
+            hourly_budget=TOKEN_BUDGET_PER_HOUR,
+            soft_ratio=BUDGET_SOFT_RATIO,
+            throttle_seconds=BUDGET_THROTTLE_SECONDS,
+            fallback_model=BUDGET_FALLBACK_MODEL,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.task_budget > 0 or self.hourly_budget > 0
+
+    def start_task(self, task_id) -> None:
+        """新任务开始时调用，重置单任务用量。"""
+        with self._lock:
+            self._task_id = task_id
+            self._task_tokens = 0
+
+    def _prune(self, now: float) -> None:
+        while self._hour and now - self._hour[0][0] >= HOUR_SECONDS:
+            self._hour_tokens -= self._hour.popleft()[1]
+
+    def _ratios(self):
+        task_ratio = self._task_tokens / self.task_budget if self.task_budget > 0 else 0.0
+        hour_ratio = self._hour_tokens / self.hourly_budget if self.hourly_budget > 0 else 0.0
+        return task_ratio, hour_ratio
+
+    def _set_state(self, state: str, task_ratio: float, hour_ratio: float) -> None:
+        if state == self._state:
+            return
+        logger.warning(
+            "预算调控: %s -> %s (task_id=%s 任务用量 %s%%, 每小时用量 %s%%)",
+            self._state, state, self._task_id, int(task_ratio * 100), int(hour_ratio * 100),
+        )
+        self._state = state
+
+    def before_request(self, model: str, stop_event: threading.Event = None) -> Optional[str]:
+        """
+        每次 LLM 请求前调用：按当前用量阻塞等待（减速 / 暂停），返回本次应使用的模型。
+        等待期间 stop_event 被设置时返回 None，调用方应放弃本次请求。
+        """
+        if not self.enabled:
+            return model
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._prune(now)
+                task_ratio, hour_ratio = self._ratios()
+                if self.hourly_budget > 0 and self._hour_tokens >= self.hourly_budget:
+                    state = "paused"
+                    wait_sec = min(self._hour[0][0] + HOUR_SECONDS - now, MAX_PAUSE_SLICE)
+                elif max(task_ratio, hour_ratio) >= self.soft_ratio:
+                    state = "throttle"
+                    # 预约下一个派发时刻：无论多少线程并发，整体 QPS 不超过 1 / throttle_seconds
+                    slot = max(now, self._next_slot)
+                    self._next_slot = slot + self.throttle_seconds
+                    wait_sec = slot - now
+                else:
+                    state = "ok"
+                    wait_sec = 0.0
+                self._set_state(state, task_ratio, hour_ratio)
+                use_fallback = state != "ok" and bool(self.fallback_model)
+                if state == "throttle":
+                    self.metrics["throttled_requests"] += 1
+                    if use_fallback:
+                        self.metrics["fallback_requests"] += 1
+                self.metrics["throttle_seconds"] += wait_sec
+            if wait_sec > 0:
+                if stop_event is None:
+                    time.sleep(wait_sec)
+                elif stop_event.wait(wait_sec):
+                    return None
+            if state != "paused":
+                return self.fallback_model if use_fallback else model
+
+    def record(self, usage: Dict[str, Any]) -> None:
+        """请求返回后调用，累计 usage["total_tokens"]。"""
+        tokens = int(usage.get("total_tokens") or 0)
+        with self._lock:
+            self.metrics["requests"] += 1
+            self.metrics["tokens"] += tokens
+            self._task_tokens += tokens
+            if self.hourly_budget > 0:
+                self._hour.append((time.monotonic(), tokens))
+                self._hour_tokens += tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前用量与累计指标（进程级），用于日志 / 指标上报。"""
+        with self._lock:
+            self._prune(time.monotonic())
+            out = dict(self.metrics)
+            out.update(
+                state=self._state,
+                task_id=self._task_id,
+                task_tokens=self._task_tokens,
+                hour_tokens=self._hour_tokens,
+            )
+        out["throttle_seconds"] = round(out["throttle_seconds"], 1)
+        return out
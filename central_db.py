@@ -1,13 +1,31 @@
 # -*- coding: utf-8 -*-
-"""中央 MySQL：按 poem_ids 拉取诗歌、写入 place_names_match_results"""
+"""中央 MySQL：按 poem_ids 拉取诗歌、写入 place_names_match_results（及可选的地名索引表）"""
 
-import pymysql
-from pymysql.cursors import DictCursor
+import json
+import logging
+import threading
 
-from config import MYSQL_CONFIG, POEM_TABLE
+from config import MYSQL_CONFIG, POEM_TABLE, PLACE_INDEX_TABLE
+from admin_divisions import clean_value
+
+logger = logging.getLogger(__name__)
+
+# 行政区名驻留缓存：同一进程内相同的省/市/县字符串只保留一份对象
+_ADMIN_INTERN_MAX = 50000
+_admin_intern = {}
+# 地名索引表列宽（字符数）：超长值不写入，避免严格模式下一个值导致整批 executemany 失败
+PLACE_NAME_MAX = 255
+ADMIN_NAME_MAX = 64
+# 地名索引表状态：None 未检查 / "ready" 可写 / "missing" 建表失败且表不存在（不再重试，需预先建表）
+_place_index_table_state = None
+_place_index_lock = threading.Lock()
 
 
 def get_connection(use_dict_cursor=True):
+    # pymysql 在首次连库时才导入（领到任务之前不需要）
+    import pymysql
+    from pymysql.cursors import DictCursor
+
     kwargs = dict(MYSQL_CONFIG)
     if use_dict_cursor:
         kwargs["cursorclass"] = DictCursor
@@ -60,3 +78,139 @@ def insert_match_results(task_id: int, results: list):
         conn.commit()
     finally:
         conn.close()
+
+
+def _fit(value, limit):
+    """规整字符串；空值、占位文本与超过列宽的值返回 None。"""
+    text = clean_value(value)
+    if text is None or len(text) > limit:
+        return None
+    return text
+
+
+def _intern_admin(value):
+    """规整并驻留行政区字符串；空值、"未知"等占位文本与超长值返回 None。"""
+    text = _fit(value, ADMIN_NAME_MAX)
+    if text is None:
+        return None
+    cached = _admin_intern.get(text)
+    if cached is not None:
+        return cached
+    if len(_admin_intern) < _ADMIN_INTERN_MAX:
+        _admin_intern[text] = text
+    return text
+
+
+def build_place_index_rows(task_id: int, results: list):
+    """
+    把 match_names JSON（prompt_id=3 格式）展开为地名索引行。
+    返回: [(quiz_poem_2_id, task_id, name, modern_name, province, city, county), ...]；非 JSON 结果跳过。
+    name 缺失或超长的地名跳过；modern_name 未知时为 ""；同一首诗内 (name, modern_name) 重复的只保留第一条。
+    """
+    rows = []
+    seen = set()
+    for poem_id, match_names in results:
+        try:
+            obj = json.loads(match_names)
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(obj, dict):
+            continue
+        for place in obj.get("places") or []:
+            if not isinstance(place, dict):
+                continue
+            name = _fit(place.get("name"), PLACE_NAME_MAX)
+            if not name:
+                continue
+            modern_name = _fit(place.get("modern_name"), PLACE_NAME_MAX) or ""
+            if (poem_id, name, modern_name) in seen:
+                continue
+            seen.add((poem_id, name, modern_name))
+            rows.append((
+                poem_id,
+                task_id,
+                name,
+                modern_name,
+                _intern_admin(place.get("province")),
+                _intern_admin(place.get("city")),
+                _intern_admin(place.get("county")),
+            ))
+    return rows
+
+
+def _ensure_place_index_table(conn):
+    """
+    首次写入时确保索引表存在，结果进程内缓存：
+    建表失败（如无 DDL 权限）时若表已存在仍可写，否则记一次告警，之后不再尝试。
+    返回: 表是否可写。
+    """
+    global _place_index_table_state
+    if _place_index_table_state is not None:
+        return _place_index_table_state == "ready"
+    with _place_index_lock:
+        if _place_index_table_state is not None:
+            return _place_index_table_state == "ready"
+        try:
+            _create_place_index_table(conn)
+            _place_index_table_state = "ready"
+        except Exception as e:
+            with conn.cursor() as cur:
+                cur.execute("SHOW TABLES LIKE %s", (PLACE_INDEX_TABLE,))
+                exists = cur.fetchone() is not None
+            _place_index_table_state = "ready" if exists else "missing"
+            if not exists:
+                logger.warning("地名索引表 %s 创建失败且不存在，本进程不再写入索引，请预先建表: %s", PLACE_INDEX_TABLE, e)
+        return _place_index_table_state == "ready"
+
+
+def _create_place_index_table(conn):
+    """
+    建表 DDL（已存在则跳过），按名称与行政区建索引。
+    (quiz_poem_2_id, name, modern_name) 唯一，任务重跑时重复行被 INSERT IGNORE 跳过；
+    modern_name 用 "" 表示未知（唯一键中 NULL 互不相等，无法去重）。
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS `{PLACE_INDEX_TABLE}` ("
+            "id BIGINT AUTO_INCREMENT PRIMARY KEY, "
+            "quiz_poem_2_id INT NOT NULL, "
+            "task_id INT NULL, "
+            f"name VARCHAR({PLACE_NAME_MAX}) NOT NULL, "
+            f"modern_name VARCHAR({PLACE_NAME_MAX}) NOT NULL DEFAULT '', "
+            f"province VARCHAR({ADMIN_NAME_MAX}) NULL, "
+            f"city VARCHAR({ADMIN_NAME_MAX}) NULL, "
+            f"county VARCHAR({ADMIN_NAME_MAX}) NULL, "
+            "UNIQUE KEY uk_poem_place (quiz_poem_2_id, name, modern_name), "
+            "KEY idx_name (name), "
+            "KEY idx_modern_name (modern_name), "
+            "KEY idx_admin (province, city, county)"
+            ") DEFAULT CHARSET=utf8mb4"
+        )
+    conn.commit()
+
+
+def insert_place_index(task_id: int, results: list):
+    """
+    将地名提取结果展开为规范化行，批量写入地名索引表（PLACE_INDEX_TABLE）。
+    results 与 insert_match_results 相同；已存在的 (诗, 地名) 行跳过（可重复执行）。返回新写入行数。
+    """
+    if _place_index_table_state == "missing":
+        return 0
+    rows = build_place_index_rows(task_id, results)
+    if not rows:
+        return 0
+    conn = get_connection(use_dict_cursor=False)
+    try:
+        if not _ensure_place_index_table(conn):
+            return 0
+        with conn.cursor() as cur:
+            inserted = cur.executemany(
+                f"INSERT IGNORE INTO `{PLACE_INDEX_TABLE}` "
+                "(quiz_poem_2_id, task_id, name, modern_name, province, city, county) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                rows,
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    return inserted or 0
@@ -26,6 +26,10 @@ MYSQL_CONFIG = {
 # 诗歌表名（中央库中的诗歌表）
 POEM_TABLE = os.getenv("POEM_TABLE", "quiz_poem_2")
 
+# 地名索引表：开启后除 match_names JSON 外，另将每个地名展开为一行写入该表（1 开启，0 关闭）
+PLACE_INDEX_ENABLED = os.getenv("PLACE_INDEX_ENABLED", "0").lower() in ("1", "true", "yes")
+PLACE_INDEX_TABLE = os.getenv("PLACE_INDEX_TABLE", "place_names_index")
+
 # LLM 平台：siliconflow（默认）/ aliyun / openrouter，对应 .env 中的 LLM_PLATFORM
 LLM_PLATFORM = os.getenv("LLM_PLATFORM", "siliconflow")
 
@@ -37,6 +41,14 @@ TASK_TIMEOUT = int(os.getenv("TASK_TIMEOUT", "120"))
 MAX_CHARS_PER_BATCH = int(os.getenv("MAX_CHARS_PER_BATCH", "1000"))
 MAX_ITEMS_PER_BATCH = int(os.getenv("MAX_ITEMS_PER_BATCH", "20"))
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "2"))
+# 长诗分段：单首超过 MAX_CHARS_PER_BATCH 时按行切成重叠窗口分别提取再合并（1 开启，0 关闭，默认关闭）
+SEGMENT_LONG_POEMS = os.getenv("SEGMENT_LONG_POEMS", "0").lower() in ("1", "true", "yes")
+# 相邻窗口重叠的行数（避免地名恰好落在窗口边界被截断）
+SEGMENT_OVERLAP_LINES = int(os.getenv("SEGMENT_OVERLAP_LINES", "2"))
+# 地名校验与规范化：按行政区划索引补通名、补上级、纠正层级，只对与索引矛盾的地名定向重试（1 开启，0 关闭）
+VALIDATE_PLACES = os.getenv("VALIDATE_PLACES", "1").lower() in ("1", "true", "yes")
+# 行政区划数据（JSON: {省: {市: [县, ...]}}），默认使用仓库附带的 admin_divisions.json；不存在时只补全省级通名
+ADMIN_DIVISIONS_FILE = os.getenv("ADMIN_DIVISIONS_FILE", "admin_divisions.json")
 
 # LLM 请求 QPS 控制（避免 429）：每秒最多请求数，≤0 表示不限制
 LLM_MAX_QPS = float(os.getenv("LLM_MAX_QPS", "2.0"))
@@ -45,5 +57,30 @@ LLM_429_BACKOFF_SECONDS = int(os.getenv("LLM_429_BACKOFF_SECONDS", "60"))
 # 429 最大重试次数（单次请求内）
 LLM_429_MAX_RETRIES = int(os.getenv("LLM_429_MAX_RETRIES", "5"))
 
+# Token 预算（按 usage.total_tokens 统计，≤0 表示不限制）：单任务预算与最近一小时预算
+# 单任务预算用尽后继续减速 + 备用模型完成该任务；每小时预算用尽后暂停派发直到窗口释放
+TOKEN_BUDGET_PER_TASK = int(os.getenv("TOKEN_BUDGET_PER_TASK", "0"))
+TOKEN_BUDGET_PER_HOUR = int(os.getenv("TOKEN_BUDGET_PER_HOUR", "0"))
+# 用量达到预算的该比例后开始调控：所有线程合计每 BUDGET_THROTTLE_SECONDS 秒最多派发一个请求，并改用 BUDGET_FALLBACK_MODEL（留空则不换模型）
+BUDGET_SOFT_RATIO = float(os.getenv("BUDGET_SOFT_RATIO", "0.8"))
+BUDGET_THROTTLE_SECONDS = float(os.getenv("BUDGET_THROTTLE_SECONDS", "2"))
+BUDGET_FALLBACK_MODEL = os.getenv("BUDGET_FALLBACK_MODEL", "")
+
+# LLM 流量录制：非空时把每次请求的 prompt / 响应 / 耗时 / usage 追加写入该 JSONL 文件
+LLM_RECORD_FILE = os.getenv("LLM_RECORD_FILE", "")
+# 回放录制文件只能通过 `python llm_replay.py record.jsonl` 进行，worker 不支持回放
+
 # 无任务时轮询间隔（秒）
 POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "30"))
+# 收到 SIGTERM/SIGINT 后等待进行中 LLM 请求完成的最长秒数（应小于容器的停止宽限期）
+SHUTDOWN_GRACE_SECONDS = float(os.getenv("SHUTDOWN_GRACE_SECONDS", "25"))
+
+# 日志：JSON-lines 写入 LOG_FILE，由后台线程异步写出
+LOG_FILE = os.getenv("LOG_FILE", "ask.log")
+# 按大小轮转（字节）与保留份数；LOG_ROTATE_WHEN 非空（如 midnight / H）时改为按时间轮转
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+# 重复 WARNING 采样：同一消息每 LOG_SAMPLE_WINDOW 秒最多输出 LOG_SAMPLE_BURST 条，≤0 表示不采样
+LOG_SAMPLE_WINDOW = float(os.getenv("LOG_SAMPLE_WINDOW", "0"))
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "5"))
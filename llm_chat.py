@@ -5,39 +5,88 @@ import os
 import time
 import logging
 import threading
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from types import SimpleNamespace
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
 from dotenv import load_dotenv
-from openai import OpenAI
 
+from logging_setup import setup_logging
+from llm_replay import get_recorder, get_replay_backend
+
+# requests / urllib3 / openai 按需在首次调用对应平台时导入，缩短 worker 冷启动时间
 load_dotenv()
 
-SILICONFLOW_API_KEY = os.getenv("SILICONFLOW_API_KEY")
-DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY") or os.getenv("OPEN_ROUTER_KEY")
 LOG_FILE = os.getenv("LOG_FILE", "ask.log")
 
+SILICONFLOW_URL = "https://api.siliconflow.cn/v1/chat/completions"
 # OpenAI 兼容接口的 base_url
 ALIYUN_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
+
+@dataclass(frozen=True)
+class LLMSettings:
+    """一次性解析好的 LLM 调用配置（不可变），热路径只读字段，不再反复 import config。"""
+
+    platform: str
+    api_key: str
+    base_url: Optional[str]
+    max_qps: float
+    backoff_429: int
+    max_429_retries: int
+    record_file: str = ""
+    # 只由 llm_replay.py 命令行设置，避免 worker 把回放结果写入中央库
+    replay_file: str = ""
+
+
+@lru_cache(maxsize=None)
+def get_llm_settings(platform: str = None) -> LLMSettings:
+    """
+    解析指定平台（默认 config.LLM_PLATFORM）的配置，按平台缓存；只读取该平台的 API Key。
+    """
+    try:
+        import config
+        default_platform = config.LLM_PLATFORM
+        max_qps = config.LLM_MAX_QPS
+        backoff_429 = config.LLM_429_BACKOFF_SECONDS
+        max_429_retries = config.LLM_429_MAX_RETRIES
+        record_file = config.LLM_RECORD_FILE
+    except ImportError:
+        default_platform, max_qps, backoff_429, max_429_retries = "siliconflow", 0.0, 60, 5
+        record_file = ""
+    platform = (platform or default_platform or "siliconflow").lower().strip()
+    if platform == "siliconflow":
+        api_key, base_url = os.getenv("SILICONFLOW_API_KEY"), None
+    elif platform == "aliyun":
+        api_key, base_url = os.getenv("DASHSCOPE_API_KEY"), ALIYUN_BASE_URL
+    elif platform == "openrouter":
+        api_key = os.getenv("OPENROUTER_API_KEY") or os.getenv("OPEN_ROUTER_KEY")
+        base_url = OPENROUTER_BASE_URL
+    else:
+        raise ValueError(f"Unsupported mode: {platform}，支持: siliconflow / aliyun / openrouter")
+    return LLMSettings(
+        platform=platform,
+        api_key=(api_key or "").strip(),
+        base_url=base_url,
+        max_qps=max_qps,
+        backoff_429=backoff_429,
+        max_429_retries=max_429_retries,
+        record_file=record_file,
+    )
+
+
 # QPS 限流（全局、线程安全）：上次请求时间与最小间隔
 _rate_limit_lock = threading.Lock()
 _rate_limit_last_time = 0.0
 
 
-def _wait_rate_limit():
+def _wait_rate_limit(max_qps: float):
     """在发起 LLM 请求前调用，保证不超过配置的 QPS。"""
     global _rate_limit_last_time
-    try:
-        from config import LLM_MAX_QPS
-    except ImportError:
+    if max_qps <= 0:
         return
-    if LLM_MAX_QPS <= 0:
-        return
-    min_interval = 1.0 / LLM_MAX_QPS
+    min_interval = 1.0 / max_qps
     with _rate_limit_lock:
         now = time.monotonic()
         elapsed = now - _rate_limit_last_time
@@ -45,54 +94,105 @@ def _wait_rate_limit():
             time.sleep(min_interval - elapsed)
         _rate_limit_last_time = time.monotonic()
 
-logger = logging.getLogger("LLMChatLogger")
-logger.setLevel(logging.INFO)
-file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8")
-formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
 
-# 关闭 httpx/httpcore 的每条请求 INFO 日志（openai 调阿里云等时使用），只保留 WARNING 及以上
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("httpcore").setLevel(logging.WARNING)
+logger = logging.getLogger("LLMChatLogger")
 
 
 class LLMChat:
     _session = None
+    _openai_clients = {}
+    _init_lock = threading.Lock()
 
     @classmethod
     def _get_session(cls):
         if cls._session is None:
-            cls._session = requests.Session()
-            # 429 由下方 get_selicon_completion_once 内单独退避，此处只重试 5xx
-            retry_strategy = Retry(
-                total=3,
-                backoff_factor=1,
-                status_forcelist=[500, 502, 503, 504],
-                allowed_methods=["POST"],
-            )
-            adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=20, pool_maxsize=20)
-            cls._session.mount("https://", adapter)
+            with cls._init_lock:
+                if cls._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    from urllib3.util.retry import Retry
+
+                    session = requests.Session()
+                    # 429 由下方 get_selicon_completion_once 内单独退避，此处只重试 5xx
+                    retry_strategy = Retry(
+                        total=3,
+                        backoff_factor=1,
+                        status_forcelist=[500, 502, 503, 504],
+                        allowed_methods=["POST"],
+                    )
+                    adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=20, pool_maxsize=20)
+                    session.mount("https://", adapter)
+                    cls._session = session
         return cls._session
 
-    def __init__(self):
+    @classmethod
+    def _get_openai_client(cls, settings: LLMSettings):
+        """按 (base_url, api_key) 复用 OpenAI 客户端，首次使用时才导入 openai。"""
+        key = (settings.base_url, settings.api_key)
+        client = cls._openai_clients.get(key)
+        if client is None:
+            with cls._init_lock:
+                client = cls._openai_clients.get(key)
+                if client is None:
+                    from openai import OpenAI
+
+                    client = OpenAI(api_key=settings.api_key, base_url=settings.base_url, timeout=120.0)
+                    cls._openai_clients[key] = client
+        return client
+
+    def __init__(self, settings: LLMSettings = None, stop_event: threading.Event = None):
+        # 日志管线在首次使用 LLM 时才启动（LOG_FILE 延迟到第一条日志写出时才打开）
+        setup_logging(log_file=LOG_FILE)
+        self.settings = settings or get_llm_settings()
+        # 停止信号：置位后 429 退避立即结束，不再重试
+        self.stop_event = stop_event
         self.system_message = {"role": "system", "content": "You are a helpful assistant."}
         self.messages = [self.system_message]
 
-    def dict_to_obj(self, d):
-        if isinstance(d, dict):
-            return SimpleNamespace(**{k: self.dict_to_obj(v) for k, v in d.items()})
-        if isinstance(d, list):
-            return [self.dict_to_obj(i) for i in d]
-        return d
+    @staticmethod
+    def _field(obj, name):
+        """兼容 dict（SiliconFlow 原始 JSON）与 OpenAI SDK 对象的字段读取。"""
+        if obj is None:
+            return None
+        if isinstance(obj, dict):
+            return obj.get(name)
+        return getattr(obj, name, None)
+
+    @classmethod
+    def extract_completion(cls, completion):
+        """
+        只取 content / finish_reason / usage 三项，不做整体对象转换。
+        返回: (content: str, finish_reason: str | None, usage_dict)；
+        没有 choices 或 content 为空时 content 返回 ""，已计费的 usage 与 finish_reason 照常返回。
+        """
+        usage = cls._field(completion, "usage")
+        usage_dict = {
+            "prompt_tokens": cls._field(usage, "prompt_tokens") or 0,
+            "completion_tokens": cls._field(usage, "completion_tokens") or 0,
+            "total_tokens": cls._field(usage, "total_tokens") or 0,
+        }
+        choices = cls._field(completion, "choices")
+        if not choices:
+            return "", None, usage_dict
+        choice = choices[0]
+        content = cls._field(cls._field(choice, "message"), "content")
+        return content or "", cls._field(choice, "finish_reason"), usage_dict
+
+    def _settings_for(self, platform: str) -> LLMSettings:
+        if platform is None or platform.lower().strip() == self.settings.platform:
+            return self.settings
+        return get_llm_settings(platform)
 
     def get_selicon_completion_once(self, question: str, model: str, enable_thinking: bool = False):
-        if not (SILICONFLOW_API_KEY or "").strip():
+        import requests
+
+        settings = self._settings_for("siliconflow")
+        if not settings.api_key:
             raise ValueError(
                 "SILICONFLOW_API_KEY 未设置。请在运行容器时通过 --env-file 传入 .env，或设置环境变量 SILICONFLOW_API_KEY。"
             )
         headers = {
-            "Authorization": f"Bearer {SILICONFLOW_API_KEY}",
+            "Authorization": f"Bearer {settings.api_key}",
             "Content-Type": "application/json",
         }
         data = {
@@ -102,18 +202,12 @@ class LLMChat:
         }
         session = self._get_session()
         try:
-            backoff_sec = 60
-            max_429_retries = 5
-            try:
-                from config import LLM_429_BACKOFF_SECONDS, LLM_429_MAX_RETRIES
-                backoff_sec = LLM_429_BACKOFF_SECONDS
-                max_429_retries = LLM_429_MAX_RETRIES
-            except ImportError:
-                pass
+            backoff_sec = settings.backoff_429
+            max_429_retries = settings.max_429_retries
             for attempt in range(max_429_retries + 1):
-                _wait_rate_limit()
+                _wait_rate_limit(settings.max_qps)
                 resp = session.post(
-                    "https://api.siliconflow.cn/v1/chat/completions",
+                    SILICONFLOW_URL,
                     headers=headers,
                     json=data,
                     timeout=(10, 120),
@@ -131,12 +225,14 @@ class LLMChat:
                             "SiliconFlow 429 限流，等待 %s 秒后重试 (第 %s/%s 次)",
                             wait_sec, attempt + 1, max_429_retries,
                         )
-                        time.sleep(wait_sec)
+                        if self.stop_event is None:
+                            time.sleep(wait_sec)
+                        elif self.stop_event.wait(wait_sec):
+                            raise ValueError("收到停止信号，放弃 429 重试")
                         continue
                     resp.raise_for_status()
                 resp.raise_for_status()
-                raw = resp.json()
-                return self.dict_to_obj(raw)
+                return resp.json()
         except requests.exceptions.Timeout as e:
             logger.error(f"Request timeout for model {model}: {e}")
             raise ValueError(f"SiliconFlow 请求超时 (model={model}): {e}") from e
@@ -154,62 +250,48 @@ class LLMChat:
             logger.error(f"Unexpected error: {e}")
             raise ValueError(f"SiliconFlow 调用异常 (model={model}): {e}") from e
 
-    def _get_openai_completion_once(self, question: str, model: str, base_url: str, api_key: str):
+    def _get_openai_completion_once(self, question: str, model: str, settings: LLMSettings):
         """通过 OpenAI 兼容接口请求（阿里云、OpenRouter 等）。"""
-        if not (api_key or "").strip():
+        if not settings.api_key:
             raise ValueError("未设置对应平台的 API Key，请在 .env 中配置。")
-        client = OpenAI(api_key=api_key.strip(), base_url=base_url, timeout=120.0)
-        _wait_rate_limit()
+        client = self._get_openai_client(settings)
+        _wait_rate_limit(settings.max_qps)
         resp = client.chat.completions.create(
             model=model,
             messages=[self.system_message, {"role": "user", "content": question}],
             extra_body={"enable_thinking": False},
         )
-        return self.dict_to_obj(resp.model_dump())
+        return resp
 
     def get_completion_once(self, question: str, model: str, mode: str = None, enable_thinking=False):
-        if mode is None:
-            try:
-                from config import LLM_PLATFORM
-                mode = LLM_PLATFORM
-            except ImportError:
-                mode = "siliconflow"
-        mode = (mode or "siliconflow").lower().strip()
-        if mode == "siliconflow":
-            completion = self.get_selicon_completion_once(question, model, enable_thinking)
-            return completion
-        if mode == "aliyun":
-            completion = self._get_openai_completion_once(
-                question, model, ALIYUN_BASE_URL, DASHSCOPE_API_KEY or ""
-            )
-            return completion
-        if mode == "openrouter":
-            completion = self._get_openai_completion_once(
-                question, model, OPENROUTER_BASE_URL, OPENROUTER_API_KEY or ""
-            )
-            return completion
-        raise ValueError(f"Unsupported mode: {mode}，支持: siliconflow / aliyun / openrouter")
+        settings = self._settings_for(mode)
+        if settings.replay_file:
+            return get_replay_backend(settings.replay_file).completion(question, model)
+        if settings.platform == "siliconflow":
+            return self.get_selicon_completion_once(question, model, enable_thinking)
+        return self._get_openai_completion_once(question, model, settings)
 
     def ask_once_with_usage(self, question: str, model: str, mode: str = None, enable_thinking: bool = False):
+        """
+        返回: (response: str, usage_dict)。usage_dict 除 token 数外带 finish_reason，
+        为 "length" 时表示输出被截断，调用方可据此拆小批次重试。
+        """
         try:
+            start = time.perf_counter()
             completion = self.get_completion_once(question, model, mode, enable_thinking)
-            if not hasattr(completion, "choices") or not completion.choices:
-                raise ValueError("Invalid completion: no choices")
-            msg = completion.choices[0].message
-            if not hasattr(msg, "content"):
-                raise ValueError("Invalid completion: no message content")
-            response = msg.content
-            usage = (
-                completion.usage
-                if hasattr(completion, "usage") and completion.usage
-                else None
-            )
-            usage_dict = {
-                "prompt_tokens": getattr(usage, "prompt_tokens", 0) if usage else 0,
-                "completion_tokens": getattr(usage, "completion_tokens", 0) if usage else 0,
-                "total_tokens": getattr(usage, "total_tokens", 0) if usage else 0,
-            }
+            latency = time.perf_counter() - start
+            response, finish_reason, usage_dict = self.extract_completion(completion)
+            settings = self._settings_for(mode)
+            if settings.record_file:
+                get_recorder(settings.record_file).record(
+                    question, model, settings.platform, response, finish_reason, usage_dict, latency
+                )
+            usage_dict["finish_reason"] = finish_reason
+            if finish_reason == "length":
+                logger.warning("模型输出被截断 (finish_reason=length, model=%s)", model)
+            elif not response:
+                logger.warning("模型返回空内容 (finish_reason=%s, model=%s, usage=%s)", finish_reason, model, usage_dict)
             return response, usage_dict
         except Exception as e:
             logger.error(f"Error in ask_once_with_usage: {e}")
-            return "", {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            return "", {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "finish_reason": None}
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 流量录制与回放：录制模式把每次请求的 prompt、响应、耗时与 usage 追加写入 JSONL；
+回放模式按 prompt 哈希从录制文件取回响应，不访问任何平台，可离线全速复现一次 run_extraction。
+回放只通过本脚本进行（结果只输出统计，不写入中央库）。
+用法（离线复现）: python llm_replay.py record.jsonl [--poems poems.json]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def prompt_hash(question: str, model: str) -> str:
+    """回放键：模型 + 完整 prompt 的 sha256。"""
+    return hashlib.sha256(f"{model}\n{question}".encode("utf-8")).hexdigest()
+
+
+class LLMRecorder:
+    """线程安全地把请求/响应追加到 JSONL 文件（首次写入时才打开文件）。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def record(
+        self,
+        question: str,
+        model: str,
+        platform: str,
+        response: str,
+        finish_reason: str,
+        usage: Dict[str, Any],
+        latency: float,
+    ) -> None:
+        entry = {
+            "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "hash": prompt_hash(question, model),
+            "platform": platform,
+            "model": model,
+            "prompt": question,
+            "response": response,
+            "finish_reason": finish_reason,
+            "usage": {k: usage.get(k, 0) for k in ("prompt_tokens", "completion_tokens", "total_tokens")},
+            "latency": round(latency, 3),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+
+
+class LLMReplayBackend:
+    """
+    按 prompt 哈希返回录制的响应（与 SiliconFlow 原始 JSON 同形的 dict）。
+    同一 prompt 录制了多次时按录制顺序轮流返回；未命中抛 ValueError。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, deque] = defaultdict(deque)
+        self.hits = 0
+        self.misses = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                key = entry.get("hash") or prompt_hash(entry.get("prompt", ""), entry.get("model", ""))
+                self._entries[key].append(entry)
+        logger.info("回放数据已加载: %s 个不同 prompt (%s)", len(self._entries), path)
+
+    def completion(self, question: str, model: str) -> Dict[str, Any]:
+        key = prompt_hash(question, model)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                raise ValueError(f"回放未命中 (model={model}, hash={key[:12]})")
+            self.hits += 1
+            entry = entries[0]
+            entries.rotate(-1)
+        return {
+            "choices": [{"message": {"content": entry.get("response", "")}, "finish_reason": entry.get("finish_reason")}],
+            "usage": entry.get("usage") or {},
+        }
+
+
+@lru_cache(maxsize=None)
+def get_recorder(path: str) -> LLMRecorder:
+    return LLMRecorder(path)
+
+
+@lru_cache(maxsize=None)
+def get_replay_backend(path: str) -> LLMReplayBackend:
+    return LLMReplayBackend(path)
+
+
+def poems_from_recording(path: str) -> List[Tuple[Any, ...]]:
+    """
+    从录制的批量 prompt 中还原诗歌元组 (id, title, dynasty, author, content)。
+    依赖 content 字段为 "题目 朝代 作者 正文" 的拼接；分段提取的长诗（同一 id 出现多个不同正文）无法还原，跳过。
+    """
+    seen: Dict[int, str] = {}
+    segmented = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                prompt = json.loads(line).get("prompt", "")
+                payload = json.loads(prompt[prompt.index('{"poems"'):])
+            except (ValueError, AttributeError):
+                continue
+            if not isinstance(payload, dict):
+                continue
+            for obj in payload.get("poems", []):
+                try:
+                    pid, content = int(obj["id"]), obj.get("content", "")
+                except (KeyError, TypeError, ValueError, AttributeError):
+                    continue
+                if pid in seen and seen[pid] != content:
+                    segmented.add(pid)
+                seen.setdefault(pid, content)
+    poems = []
+    for pid in sorted(seen):
+        if pid in segmented:
+            continue
+        parts = seen[pid].split(" ", 3)
+        parts += [""] * (4 - len(parts))
+        poems.append((pid, *parts))
+    return poems
+
+
+def main():
+    import dataclasses
+
+    from config import (
+        DEFAULT_MODEL,
+        PROMPT_ID,
+        MAX_WORKERS,
+        MAX_CHARS_PER_BATCH,
+        MAX_ITEMS_PER_BATCH,
+        MAX_RETRIES,
+        SEGMENT_LONG_POEMS,
+        SEGMENT_OVERLAP_LINES,
+        VALIDATE_PLACES,
+    )
+    from llm_chat import get_llm_settings
+    from logging_setup import setup_logging
+    from place_extractor import run_extraction
+    # 以脚本运行时本文件是 __main__，需从 llm_replay 模块取与 LLMChat 共用的回放实例
+    import llm_replay
+
+    parser = argparse.ArgumentParser(description="用录制的 LLM 流量离线复现 run_extraction")
+    parser.add_argument("record_file", help="LLM_RECORD_FILE 录制的 JSONL")
+    parser.add_argument("--poems", help="诗歌 JSON 文件 [[id, title, dynasty, author, content], ...]；缺省时从录制中还原")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.poems:
+        with open(args.poems, encoding="utf-8") as f:
+            poems = [tuple(p) for p in json.load(f)]
+    else:
+        poems = poems_from_recording(args.record_file)
+    settings = dataclasses.replace(get_llm_settings(), replay_file=args.record_file, record_file="", max_qps=0.0)
+    backend = llm_replay.get_replay_backend(args.record_file)
+
+    t0 = time.perf_counter()
+    results, _ = run_extraction(
+        poems,
+        model=args.model,
+        prompt_id=PROMPT_ID,
+        max_workers=MAX_WORKERS,
+        task_timeout=None,
+        max_chars_per_batch=MAX_CHARS_PER_BATCH,
+        max_items_per_batch=MAX_ITEMS_PER_BATCH,
+        max_retries=MAX_RETRIES,
+        segment_long_poems=SEGMENT_LONG_POEMS,
+        segment_overlap_lines=SEGMENT_OVERLAP_LINES,
+        llm_settings=settings,
+        validate_places=VALIDATE_PLACES,
+    )
+    elapsed = time.perf_counter() - t0
+    failed = sum(1 for _, m in results if m == '{"error":"format_error"}')
+    logger.info(
+        "回放完成: %s 首诗, 失败 %s, 命中 %s, 未命中 %s, 耗时 %.3f s",
+        len(results), failed, backend.hits, backend.misses, elapsed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""日志管线：业务线程只把日志记录放进队列，由后台线程写 JSON-lines 文件（按大小/时间轮转）与控制台"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+try:
+    from config import (
+        LOG_FILE,
+        LOG_MAX_BYTES,
+        LOG_BACKUP_COUNT,
+        LOG_ROTATE_WHEN,
+        LOG_SAMPLE_WINDOW,
+        LOG_SAMPLE_BURST,
+    )
+except ImportError:
+    LOG_FILE = os.getenv("LOG_FILE", "ask.log")
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+    LOG_BACKUP_COUNT = 5
+    LOG_ROTATE_WHEN = ""
+    LOG_SAMPLE_WINDOW = 0.0
+    LOG_SAMPLE_BURST = 5
+
+CONSOLE_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_setup_lock = threading.Lock()
+_listener = None
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """每条记录输出一行 JSON：ts / level / logger / thread / msg，采样抑制数写在 suppressed。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class WarningSampler(logging.Filter):
+    """
+    对重复 WARNING 做采样：同一 (logger, 消息模板) 每 window 秒最多放行 burst 条，
+    其余直接丢弃（不进队列），下一条放行的记录带上被抑制的条数。window<=0 时不采样。
+    """
+
+    def __init__(self, window: float, burst: int):
+        super().__init__()
+        self.window = window
+        self.burst = max(1, burst)
+        self._lock = threading.Lock()
+        self._state = {}  # key -> [window_start, emitted, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.window <= 0 or record.levelno != logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                self._state[key] = [now, 1, 0]
+                record.suppressed = suppressed
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                record.suppressed = state[2]
+                state[2] = 0
+                return True
+            state[2] += 1
+            return False
+
+
+def _build_file_handler(log_file: str) -> logging.Handler:
+    if LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            log_file, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True
+        )
+    handler.setFormatter(JsonLinesFormatter())
+    return handler
+
+
+def setup_logging(level: int = logging.INFO, log_file: str = None) -> None:
+    """
+    配置根日志器：只挂一个 QueueHandler，控制台与轮转文件由后台 QueueListener 线程写出。
+    重复调用无副作用；日志文件在第一条记录写出时才打开；进程退出时自动 flush 队列。
+    """
+    global _listener
+    if _listener is not None:
+        return
+    with _setup_lock:
+        if _listener is not None:
+            return
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(WarningSampler(LOG_SAMPLE_WINDOW, LOG_SAMPLE_BURST))
+
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(logging.Formatter(CONSOLE_FORMAT, datefmt=DATE_FORMAT))
+        handlers = [console, _build_file_handler(log_file or LOG_FILE)]
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(queue_handler)
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+    # 关闭 httpx/httpcore 的每条请求 INFO 日志（openai 调阿里云等时使用），只保留 WARNING 及以上
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("httpcore").setLevel(logging.WARNING)
+
+
+def shutdown_logging() -> None:
+    """停止后台写线程并写完队列中剩余记录。"""
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
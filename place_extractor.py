@@ -3,22 +3,21 @@
 
 import json
 import logging
+import re
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Any, Dict, Iterable, List, Tuple
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
 
 logger = logging.getLogger(__name__)
 
 # 进度输出间隔（秒）
 PROGRESS_INTERVAL = 10
 
-from llm_chat import LLMChat
+from llm_chat import LLMChat, LLMSettings
+from admin_divisions import canonicalize_places
+from budget_governor import BudgetGovernor
 
-try:
-    from config import LLM_PLATFORM
-    MODE = LLM_PLATFORM
-except ImportError:
-    MODE = "siliconflow"
 ENABLE_THINKING = False
 
 
@@ -70,7 +69,18 @@ def parse_ai_response_simple(response: str, prompt_id: int = 1):
     return is_geo, match_names
 
 
-def parse_ai_batch_response(response: str, expected_ids: Iterable[int], prompt_id: int) -> Dict[int, str]:
+def parse_ai_batch_response(
+    response: str,
+    expected_ids: Iterable[int],
+    prompt_id: int,
+    validate: bool = False,
+    flagged: Dict[int, str] | None = None,
+) -> Dict[int, str]:
+    """
+    解析批量响应为 {poem_id: match_names}。validate=True（仅 prompt_id=3）时按行政区划索引规范化 places；
+    含矛盾地名的诗不放入返回值，而是写入 flagged（矛盾的行政区字段已置 null，地名本身保留），
+    供调用方定向重试，重试用尽后作为兜底结果。
+    """
     expected_set = set(int(x) for x in expected_ids)
     raw = _strip_code_fence(response)
     out: Dict[int, str] = {}
@@ -100,8 +110,15 @@ def parse_ai_batch_response(response: str, expected_ids: Iterable[int], prompt_i
             places = item.get("places", [])
             if not isinstance(places, list):
                 places = []
+            invalid = 0
+            if validate:
+                places, invalid = canonicalize_places(places)
             normalized = {"has_place": has_place, "places": places}
-            out[pid] = json.dumps(normalized, ensure_ascii=False, separators=(",", ":"))
+            compact = json.dumps(normalized, ensure_ascii=False, separators=(",", ":"))
+            if invalid and flagged is not None:
+                flagged[pid] = compact
+            else:
+                out[pid] = compact
     if prompt_id == 4:
         try:
             items = raw.split(";")
@@ -199,9 +216,122 @@ def _poem_to_obj(poem: Tuple[Any, ...]) -> Dict[str, Any]:
     return {"id": pid, "content": f"{title} {dynasty} {author} {content}"}
 
 
+# 长诗分段：按句末标点或换行切成"行"，窗口内至少保留的正文字符数
+_LINE_RE = re.compile(r"[^。！？；!?;\n]+[。！？；!?;]*\n?")
+MIN_SEGMENT_CHARS = 100
+
+
+def _split_poem_lines(content: str) -> List[str]:
+    """把正文切成行（保留句末标点），拼接回去即为原文（去掉多余空白行）。"""
+    return [m.group(0) for m in _LINE_RE.finditer(content or "")]
+
+
+class PoemSegment(NamedTuple):
+    """长诗的一个分段窗口；前 5 项与诗歌元组一致，可直接交给 _poem_to_obj。"""
+
+    id: int
+    title: str
+    dynasty: str
+    author: str
+    content: str
+    seg_index: int
+
+
+def segment_poem(
+    poem: Tuple[Any, ...], max_chars: int, overlap_lines: int = 2
+) -> List[PoemSegment]:
+    """
+    将超长诗歌按行切成相互重叠的窗口，每个窗口序列化后不超过 max_chars。
+    每段保留题目/朝代/作者，相邻窗口重叠 overlap_lines 行（不超过窗口行数的一半），避免跨行地名被截断。
+    """
+    pid = int(poem[0])
+    title = str(poem[1]) if len(poem) > 1 else ""
+    dynasty = str(poem[2]) if len(poem) > 2 else ""
+    author = str(poem[3]) if len(poem) > 3 else ""
+    content = str(poem[4]) if len(poem) > 4 else ""
+    header_size = len(json.dumps(_poem_to_obj((pid, title, dynasty, author, "")), ensure_ascii=False))
+    budget = max(max_chars - header_size, MIN_SEGMENT_CHARS)
+
+    lines: List[str] = []
+    for line in _split_poem_lines(content):
+        # 单行超出窗口预算时按字符硬切
+        while len(json.dumps(line, ensure_ascii=False)) - 2 > budget:
+            lines.append(line[:budget])
+            line = line[budget:]
+        if line:
+            lines.append(line)
+    if not lines:
+        return [PoemSegment(pid, title, dynasty, author, content, 0)]
+
+    sizes = [len(json.dumps(line, ensure_ascii=False)) - 2 for line in lines]
+    segments: List[PoemSegment] = []
+    start = 0
+    while start < len(lines):
+        end = start
+        used = 0
+        while end < len(lines) and (end == start or used + sizes[end] <= budget):
+            used += sizes[end]
+            end += 1
+        segments.append(PoemSegment(pid, title, dynasty, author, "".join(lines[start:end]), len(segments)))
+        if end >= len(lines):
+            break
+        overlap = min(overlap_lines, (end - start) // 2)
+        start = max(end - overlap, start + 1)
+    return segments
+
+
+def _is_segment(batch: List[Tuple[Any, ...]]) -> bool:
+    return len(batch) == 1 and isinstance(batch[0], PoemSegment)
+
+
+def _place_key(place: Dict[str, Any]) -> Tuple[str, str]:
+    name = str(place.get("name") or "").strip()
+    modern = str(place.get("modern_name") or "").strip()
+    return name, modern
+
+
+def merge_segment_results(compacts: List[str]) -> str:
+    """
+    合并同一首诗各分段的 prompt_id=3 结果：has_place 取或，places 按 (name, modern_name) 去重，
+    重复项用后出现的非空字段补全先出现的空字段。任一分段格式错误则返回 format_error。
+    """
+    has_place = 0
+    merged: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for compact in compacts:
+        try:
+            obj = json.loads(compact)
+        except Exception:
+            return '{"error":"format_error"}'
+        if not isinstance(obj, dict) or "error" in obj:
+            return '{"error":"format_error"}'
+        has_place = has_place or (1 if obj.get("has_place") else 0)
+        for place in obj.get("places") or []:
+            if not isinstance(place, dict):
+                continue
+            key = _place_key(place)
+            if key not in merged:
+                merged[key] = dict(place)
+                continue
+            existing = merged[key]
+            for k, v in place.items():
+                if existing.get(k) in (None, "") and v not in (None, ""):
+                    existing[k] = v
+    places = list(merged.values())
+    normalized = {"has_place": 1 if (has_place or places) else 0, "places": places}
+    return json.dumps(normalized, ensure_ascii=False, separators=(",", ":"))
+
+
 def chunk_poems_by_chars(
-    poems: List[Tuple[Any, ...]], max_chars: int = 6000, max_items: int = 12
+    poems: List[Tuple[Any, ...]],
+    max_chars: int = 6000,
+    max_items: int = 12,
+    segment_long_poems: bool = False,
+    overlap_lines: int = 2,
 ) -> List[List[Tuple[Any, ...]]]:
+    """
+    按序列化字符数与条数打包批次。超长诗歌（size >= max_chars）默认单独成批；
+    segment_long_poems=True 时改为按 segment_poem 切成多个重叠窗口，每个窗口单独成批。
+    """
     batches: List[List[Tuple[Any, ...]]] = []
     cur: List[Tuple[Any, ...]] = []
     cur_chars = 0
@@ -213,7 +343,11 @@ def chunk_poems_by_chars(
                 batches.append(cur)
                 cur = []
                 cur_chars = 0
-            batches.append([p])
+            segments = segment_poem(p, max_chars, overlap_lines) if segment_long_poems else []
+            if len(segments) > 1:
+                batches.extend([seg] for seg in segments)
+            else:
+                batches.append([p])
             continue
         if (cur and (cur_chars + size > max_chars)) or (len(cur) >= max_items):
             batches.append(cur)
@@ -227,23 +361,44 @@ def chunk_poems_by_chars(
 
 
 def analyze_poems_batch_request(
-    poems_batch: List[Tuple[Any, ...]], prompt: str, prompt_id: int, model: str
-) -> Tuple[Dict[int, str], dict]:
-    llm_chat = LLMChat()
+    poems_batch: List[Tuple[Any, ...]],
+    prompt: str,
+    prompt_id: int,
+    model: str,
+    llm_settings: LLMSettings | None = None,
+    validate: bool = False,
+    governor: BudgetGovernor | None = None,
+    shutdown_event: threading.Event | None = None,
+) -> Tuple[Dict[int, str], dict, Dict[int, str]]:
+    """
+    返回 (有效结果, usage_info, 含矛盾地名待重试的结果)。governor 给定时请求前按预算减速 / 换模型。
+    shutdown_event 被设置后，预算等待与 429 退避立即结束并放弃本次请求。
+    """
+    llm_chat = LLMChat(llm_settings, stop_event=shutdown_event)
     payload = {"poems": [_poem_to_obj(p) for p in poems_batch]}
     question = prompt + json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
-    usage_info = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    usage_info = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "finish_reason": None}
     try:
-        resp, usage_info = llm_chat.ask_once_with_usage(question, model, MODE, ENABLE_THINKING)
+        if governor is not None:
+            model = governor.before_request(model, shutdown_event)
+            if model is None:
+                # 等待预算期间收到停止信号，由调用方按中断处理
+                return {}, usage_info, {}
+        resp, usage_info = llm_chat.ask_once_with_usage(question, model, None, ENABLE_THINKING)
+        if governor is not None:
+            governor.record(usage_info)
     except Exception as e:
-        print(f"批量请求异常: {e}")
-        return {}, usage_info
+        logger.warning("批量请求异常: %s", e)
+        return {}, usage_info, {}
     expected_ids = [int(p[0]) for p in poems_batch]
-    result = parse_ai_batch_response(resp, expected_ids, prompt_id)
-    if not result and resp:
+    flagged: Dict[int, str] = {}
+    result = parse_ai_batch_response(resp, expected_ids, prompt_id, validate=validate, flagged=flagged)
+    if flagged:
+        logger.warning("地名校验未通过，待重新提取: %s", sorted(flagged))
+    elif not result and resp:
         preview = resp[:200] if len(resp) > 200 else resp
-        print(f"批量解析失败，响应预览: {preview}...")
-    return result, usage_info
+        logger.warning("批量解析失败，响应预览: %s...", preview)
+    return result, usage_info, flagged
 
 
 def _progress_reporter(
@@ -261,6 +416,30 @@ def _progress_reporter(
         logger.info("地名提取进度: 已处理 %s / 共 %s 条 (%s%%)", done, total, pct)
 
 
+def _iter_completed(future_to_batch, shutdown_event=None, drain_timeout=None):
+    """
+    依次产出已完成的 future（同 as_completed）。shutdown_event 被设置后取消尚未开始的批次，
+    已在执行的最多再等 drain_timeout 秒，超时仍未完成的丢弃。
+    """
+    if shutdown_event is None:
+        yield from as_completed(future_to_batch)
+        return
+    pending = set(future_to_batch)
+    deadline = None
+    while pending:
+        if deadline is None and shutdown_event.is_set():
+            for future in pending:
+                future.cancel()
+            deadline = time.monotonic() + (drain_timeout or 0)
+        timeout = 0.5 if deadline is None else max(0.0, deadline - time.monotonic())
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            if not future.cancelled():
+                yield future
+        if deadline is not None and time.monotonic() >= deadline:
+            return
+
+
 def analyze_poems_batches_concurrent(
     poems: List[Tuple[Any, ...]],
     prompt: str,
@@ -271,14 +450,42 @@ def analyze_poems_batches_concurrent(
     max_chars_per_batch: int = 1000,
     max_items_per_batch: int = 20,
     max_retries: int = 2,
-) -> List[Tuple[int, str]]:
+    segment_long_poems: bool = False,
+    segment_overlap_lines: int = 2,
+    llm_settings: LLMSettings | None = None,
+    validate_places: bool = False,
+    shutdown_event: threading.Event | None = None,
+    drain_timeout: float | None = None,
+    governor: BudgetGovernor | None = None,
+) -> Tuple[List[Tuple[int, str]], bool]:
     """
-    批量地名提取主入口。返回 [(poem_id, match_names_str), ...]，match_names_str 为 JSON 或 ',' 等。
+    批量地名提取主入口。返回 ([(poem_id, match_names_str), ...], interrupted)，match_names_str 为 JSON 或 ',' 等。
+    segment_long_poems=True 时超长诗歌分段提取，各段全部成功后合并为一条结果（仅 prompt_id=3）。
+    validate_places=True 时校验并规范化地名，只重试含矛盾地名的诗；重试用尽后使用矛盾字段置 null 的结果兜底。
+    输出被截断时只重新提交批次中缺失的诗并对半拆分；含矛盾地名时只重新提交缺失与矛盾的诗；其余失败整批重试。
+    shutdown_event 被设置后不再提交新批次/重试，进行中的批次最多再等 drain_timeout 秒，
+    已返回的结果照常返回，未完成的诗记为 format_error；interrupted=True 表示确实因停止信号放弃了批次或重试
+    （此时 format_error 中含未处理的诗，而不全是提取失败）。
     """
-    batches = chunk_poems_by_chars(poems, max_chars=max_chars_per_batch, max_items=max_items_per_batch)
+    batches = chunk_poems_by_chars(
+        poems,
+        max_chars=max_chars_per_batch,
+        max_items=max_items_per_batch,
+        segment_long_poems=segment_long_poems,
+        overlap_lines=segment_overlap_lines,
+    )
     id_to_result: Dict[int, str] = {}
     batch_to_ids = {tuple(b): [int(p[0]) for p in b] for b in batches}
     failed_batches = list(batches)
+    # 分段结果：poem_id -> {seg_index: compact}，全部分段返回后再合并写入 id_to_result
+    segment_total: Dict[int, int] = {}
+    segment_results: Dict[int, Dict[int, str]] = {}
+    # 校验未通过的兜底结果（已去掉无效条目），重试成功则被覆盖
+    flagged_results: Dict[int, str] = {}
+    segment_flagged: Dict[int, Dict[int, str]] = {}
+    for b in batches:
+        if _is_segment(b):
+            segment_total[int(b[0][0])] = segment_total.get(int(b[0][0]), 0) + 1
 
     stop_event = threading.Event()
     progress_thread = threading.Thread(
@@ -289,41 +496,97 @@ def analyze_poems_batches_concurrent(
     )
     progress_thread.start()
 
+    interrupted = False
     for retry_count in range(max_retries + 1):
         if not failed_batches:
             break
+        if shutdown_event is not None and shutdown_event.is_set():
+            logger.warning("收到停止信号，放弃剩余 %s 个批次", len(failed_batches))
+            break
         if retry_count > 0:
-            print(f"\n开始第 {retry_count} 次重试，失败批次数量: {len(failed_batches)}")
+            logger.info("开始第 %s 次重试，失败批次数量: %s", retry_count, len(failed_batches))
         current_failed = []
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
             future_to_batch = {
-                executor.submit(analyze_poems_batch_request, b, prompt, prompt_id, model): b
+                executor.submit(
+                    analyze_poems_batch_request,
+                    b, prompt, prompt_id, model, llm_settings, validate_places, governor, shutdown_event,
+                ): b
                 for b in failed_batches
             }
-            for future in as_completed(future_to_batch):
+            finished = 0
+            for future in _iter_completed(future_to_batch, shutdown_event, drain_timeout):
+                finished += 1
                 batch = future_to_batch[future]
                 ids = batch_to_ids[tuple(batch)]
+                usage_info, flagged = {}, {}
                 try:
-                    batch_map, _ = future.result(timeout=task_timeout) if task_timeout else future.result()
+                    batch_map, usage_info, flagged = (
+                        future.result(timeout=task_timeout) if task_timeout else future.result()
+                    )
                 except Exception as e:
                     batch_map = {}
                     if retry_count == 0:
-                        print(f"批次异常: {ids[0]}..{ids[-1]} - {e}")
+                        logger.warning("批次异常: %s..%s - %s", ids[0], ids[-1], e)
                 returned_ids = set(batch_map.keys())
                 expected_ids = set(ids)
                 missing_ids = expected_ids - returned_ids
                 if missing_ids:
-                    current_failed.append(batch)
+                    missing = [p for p in batch if int(p[0]) in missing_ids]
+                    if usage_info.get("finish_reason") == "length" and len(missing) > 1:
+                        # 输出被截断：只重试缺失的诗，并对半拆成两个更小的批次
+                        half = len(missing) // 2
+                        for part in (missing[:half], missing[half:]):
+                            batch_to_ids[tuple(part)] = [int(p[0]) for p in part]
+                            current_failed.append(part)
+                    elif flagged:
+                        # 地名校验未通过：只对矛盾与缺失的诗定向重新提取
+                        batch_to_ids[tuple(missing)] = [int(p[0]) for p in missing]
+                        current_failed.append(missing)
+                    else:
+                        current_failed.append(batch)
+                if _is_segment(batch):
+                    pid = ids[0]
+                    if pid in flagged:
+                        segment_flagged.setdefault(pid, {})[batch[0].seg_index] = flagged[pid]
+                    if pid in batch_map:
+                        segment_results.setdefault(pid, {})[batch[0].seg_index] = batch_map[pid]
+                        parts = segment_results[pid]
+                        if len(parts) == segment_total[pid]:
+                            id_to_result[pid] = merge_segment_results([parts[i] for i in sorted(parts)])
+                    continue
                 for pid, compact in batch_map.items():
                     id_to_result[pid] = compact
+                flagged_results.update(flagged)
+            if finished < len(future_to_batch):
+                # 停止信号取消了排队的批次，或进行中的批次超出 drain_timeout 被丢弃
+                interrupted = True
+        finally:
+            # 停止时不等待超出期限仍在执行的请求
+            stopping = shutdown_event is not None and shutdown_event.is_set()
+            executor.shutdown(wait=not stopping, cancel_futures=True)
         failed_batches = current_failed
+    if failed_batches and shutdown_event is not None and shutdown_event.is_set():
+        # 停止信号放弃了剩余重试，或打断了预算等待 / 429 退避
+        interrupted = True
+
+    for pid, compact in flagged_results.items():
+        id_to_result.setdefault(pid, compact)
+    for pid, total in segment_total.items():
+        if pid in id_to_result:
+            continue
+        parts = {**segment_flagged.get(pid, {}), **segment_results.get(pid, {})}
+        if len(parts) == total:
+            id_to_result[pid] = merge_segment_results([parts[i] for i in sorted(parts)])
 
     stop_event.set()
     done = len(id_to_result)
     total = len(poems)
     pct = (100 * done // total) if total else 0
     logger.info("地名提取进度: 已完成 %s / 共 %s 条 (%s%%)", done, total, pct)
-    return [(int(p[0]), id_to_result.get(int(p[0]), '{"error":"format_error"}')) for p in poems]
+    results = [(int(p[0]), id_to_result.get(int(p[0]), '{"error":"format_error"}')) for p in poems]
+    return results, interrupted
 
 
 def run_extraction(
@@ -335,15 +598,26 @@ def run_extraction(
     max_chars_per_batch: int = 1000,
     max_items_per_batch: int = 12,
     max_retries: int = 2,
-) -> List[Tuple[int, str]]:
+    segment_long_poems: bool = False,
+    segment_overlap_lines: int = 2,
+    llm_settings: LLMSettings | None = None,
+    validate_places: bool = False,
+    shutdown_event: threading.Event | None = None,
+    drain_timeout: float | None = None,
+    governor: BudgetGovernor | None = None,
+) -> Tuple[List[Tuple[int, str]], bool]:
     """
-    对诗歌列表做地名提取，返回 [(poem_id, match_names_str), ...]。
+    对诗歌列表做地名提取，返回 ([(poem_id, match_names_str), ...], interrupted)。
     match_names_str 为 prompt_id=3 时的 JSON 字符串，或 ',' 表示无地名。
     写入 place_names_match_results 时直接使用该字符串作为 match_names。
+    llm_settings 为启动时解析好的 LLM 配置（默认按 config.LLM_PLATFORM 解析一次并缓存）。
+    shutdown_event / drain_timeout 用于优雅退出；interrupted 表示提取是否被停止信号截断，见 analyze_poems_batches_concurrent。
+    governor 为 token 预算调控器（见 budget_governor），None 表示不限制。
+    segment_long_poems / validate_places 仅对 prompt_id=3 生效（prompt_id=4 为按位置对应的文本格式，无法按 id 合并）。
     """
     prompt = get_prompt(prompt_id)
     if prompt_id in (3, 4):
-        raw_results = analyze_poems_batches_concurrent(
+        return analyze_poems_batches_concurrent(
             poems,
             prompt,
             prompt_id,
@@ -353,7 +627,13 @@ def run_extraction(
             max_chars_per_batch=max_chars_per_batch,
             max_items_per_batch=max_items_per_batch,
             max_retries=max_retries,
+            segment_long_poems=segment_long_poems and prompt_id == 3,
+            segment_overlap_lines=segment_overlap_lines,
+            llm_settings=llm_settings,
+            validate_places=validate_places and prompt_id == 3,
+            shutdown_event=shutdown_event,
+            drain_timeout=drain_timeout,
+            governor=governor,
         )
-        return raw_results
     # 单首模式暂不在此实现，worker 仅用批量模式
     raise ValueError("Worker 仅支持 prompt_id 3 或 4 的批量模式")
@@ -1,15 +1,18 @@
 # -*- coding: utf-8 -*-
 """中央服务器任务 API 客户端：领取任务、上报完成"""
 
-import requests
 from config import CENTRAL_API_BASE_URL
 
+# requests 在首次调用时才导入，缩短 worker 冷启动时间
+
 
 def claim_task():
     """
     从中央服务器领取一个待处理任务。
     返回: (success: bool, task_id: int | None, poem_ids: list[int] | None, message: str)
     """
+    import requests
+
     url = f"{CENTRAL_API_BASE_URL.rstrip('/')}/api/task/claim"
     try:
         resp = requests.get(url, timeout=30)
@@ -28,6 +31,8 @@ def complete_task(task_id: int):
     向中央服务器上报任务完成。
     返回: (success: bool, message: str)
     """
+    import requests
+
     url = f"{CENTRAL_API_BASE_URL.rstrip('/')}/api/task/complete"
     try:
         resp = requests.post(url, json={"task_id": task_id}, timeout=30)
@@ -43,6 +48,8 @@ def complete_task(task_id: int):
 
 def health_check():
     """健康检查中央服务器。"""
+    import requests
+
     url = f"{CENTRAL_API_BASE_URL.rstrip('/')}/api/health"
     try:
         resp = requests.get(url, timeout=10)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""admin_divisions 规范化测试：有行政区划数据 / 无数据两种情况"""
+
+import pytest
+
+import admin_divisions
+from admin_divisions import (
+    AdminDivisionIndex,
+    build_tree_from_adcodes,
+    canonicalize_admin,
+    canonicalize_place,
+    canonicalize_places,
+    get_admin_index,
+)
+
+TREE = {
+    "浙江省": {"杭州市": ["西湖区", "钱塘区", "建德市"], "宁波市": ["海曙区"]},
+    "北京市": {"北京市": ["朝阳区", "东城区"]},
+    "吉林省": {"长春市": ["朝阳区"]},
+}
+
+
+def _use_index(monkeypatch, tree):
+    index = AdminDivisionIndex(tree)
+    monkeypatch.setattr(admin_divisions, "get_admin_index", lambda: index)
+    canonicalize_admin.cache_clear()
+
+
+@pytest.fixture
+def with_data(monkeypatch):
+    _use_index(monkeypatch, TREE)
+    yield
+    canonicalize_admin.cache_clear()
+
+
+@pytest.fixture
+def without_data(monkeypatch):
+    _use_index(monkeypatch, None)
+    yield
+    canonicalize_admin.cache_clear()
+
+
+@pytest.mark.parametrize(
+    "given, expected",
+    [
+        (("浙江", "杭州", None), ("浙江省", "杭州市", None, ())),
+        ((None, "杭州市", "西湖"), ("浙江省", "杭州市", "西湖区", ())),
+        ((None, None, "建德市"), ("浙江省", "杭州市", "建德市", ())),
+        ((None, "浙江省", None), ("浙江省", None, None, ())),
+        (("杭州市", None, None), ("浙江省", "杭州市", None, ())),
+        ((None, "北京", None), ("北京市", None, None, ())),
+        (("北京市", "朝阳区", None), ("北京市", None, "朝阳区", ())),
+        (("吉林省", None, "朝阳区"), ("吉林省", "长春市", "朝阳区", ())),
+        # 同名县在多个省，无法唯一确定上级：保留原值，不算矛盾
+        ((None, None, "朝阳区"), (None, None, "朝阳区", ())),
+        # 数据中没有的县：无法核实，原样保留
+        (("浙江省", "杭州市", "临平区"), ("浙江省", "杭州市", "临平区", ())),
+    ],
+)
+def test_canonicalize_admin_with_data(with_data, given, expected):
+    assert canonicalize_admin(*given) == expected
+
+
+@pytest.mark.parametrize(
+    "given, expected",
+    [
+        # 县存在但属于另一个市
+        (("浙江省", "杭州市", "海曙区"), ("浙江省", "杭州市", None, ("county",))),
+        # 县存在但属于另一个省
+        (("浙江省", None, "朝阳区"), ("浙江省", None, None, ("county",))),
+        # 市存在但属于另一个省
+        (("吉林省", "杭州市", None), ("吉林省", None, None, ("city",))),
+        # 既不是省也不是市
+        (("江南", None, None), (None, None, None, ("province",))),
+        # 省写进市，且与 province 矛盾
+        (("吉林省", "浙江省", None), (None, None, None, ("province", "city"))),
+    ],
+)
+def test_canonicalize_admin_conflicts(with_data, given, expected):
+    assert canonicalize_admin(*given) == expected
+
+
+@pytest.mark.parametrize(
+    "given, expected",
+    [
+        (("浙江", None, None), ("浙江省", None, None, ())),
+        ((None, "浙江省", None), ("浙江省", None, None, ())),
+        (("北京市", "朝阳区", None), ("北京市", None, "朝阳区", ())),
+        # 没有地级数据：市写在省里无法识别，视为无法核实而不是无效
+        (("杭州市", None, None), ("杭州市", None, None, ())),
+        # 没有地级数据：与省同名的市简称不当作省，保留原值
+        (("吉林省", "吉林", None), ("吉林省", "吉林", None, ())),
+        ((None, "海南", None), (None, "海南", None, ())),
+        (("江南", None, None), ("江南", None, None, ())),
+        (("浙江省", "杭州", "西湖"), ("浙江省", "杭州", "西湖", ())),
+    ],
+)
+def test_canonicalize_admin_without_data(without_data, given, expected):
+    assert canonicalize_admin(*given) == expected
+
+
+def test_canonicalize_place_cleans_placeholders(with_data):
+    place, conflicts = canonicalize_place(
+        {"name": "西湖", "modern_name": "未知", "province": "不确定", "city": "杭州", "county": "西湖区"}
+    )
+    assert conflicts == ()
+    assert place == {
+        "name": "西湖",
+        "modern_name": None,
+        "country": "中国",
+        "province": "浙江省",
+        "city": "杭州市",
+        "county": "西湖区",
+    }
+
+
+def test_canonicalize_place_keeps_name_on_conflict(with_data):
+    place, conflicts = canonicalize_place(
+        {"name": "天一阁", "modern_name": "天一阁", "province": "浙江省", "city": "杭州市", "county": "海曙区"}
+    )
+    assert conflicts == ("county",)
+    assert place["name"] == "天一阁"
+    assert place["modern_name"] == "天一阁"
+    assert (place["province"], place["city"], place["county"]) == ("浙江省", "杭州市", None)
+
+
+def test_canonicalize_place_skips_foreign_and_rejects_nameless(with_data):
+    place, conflicts = canonicalize_place({"name": "巴黎", "country": "法国", "province": "法兰西岛"})
+    assert conflicts == ()
+    assert place["province"] == "法兰西岛"
+    assert canonicalize_place({"name": "未知", "province": "浙江省"}) == (None, ("name",))
+    assert canonicalize_place("西湖") == (None, ("name",))
+
+
+def test_canonicalize_places_counts_conflicts_and_keeps_places(with_data):
+    places, invalid = canonicalize_places([
+        {"name": "西湖", "province": "浙江", "city": "杭州"},
+        {"name": "天一阁", "province": "浙江省", "city": "杭州市", "county": "海曙区"},
+        {"modern_name": "无名"},
+    ])
+    assert invalid == 2
+    assert [p["name"] for p in places] == ["西湖", "天一阁"]
+
+
+def test_build_tree_from_adcodes():
+    rows = [
+        ("110000000000", "北京市"), ("110100000000", "市辖区"), ("110101000000", "东城区"),
+        ("410000", "河南省"), ("410100", "郑州市"), ("410101", "市辖区"), ("410102", "中原区"),
+        ("419000", "省直辖县级行政区划"), ("419001", "济源市"),
+        ("440000", "广东省"), ("441900", "东莞市"),
+        ("710000", "台湾省"), ("adcode", "name"),
+    ]
+    assert build_tree_from_adcodes(rows) == {
+        "北京市": {"": ["东城区"]},
+        "河南省": {"郑州市": ["中原区"], "": ["济源市"]},
+        "广东省": {"东莞市": []},
+        "台湾省": {},
+    }
+
+
+@pytest.fixture
+def shipped_data():
+    get_admin_index.cache_clear()
+    canonicalize_admin.cache_clear()
+    yield get_admin_index()
+    get_admin_index.cache_clear()
+    canonicalize_admin.cache_clear()
+
+
+@pytest.mark.parametrize(
+    "given, expected",
+    [
+        (("浙江", "杭州", None), ("浙江省", "杭州市", None, ())),
+        ((None, "杭州", "西湖"), ("浙江省", "杭州市", "西湖区", ())),
+        (("吉林省", "吉林", None), ("吉林省", "吉林市", None, ())),
+        ((None, None, "济源市"), ("河南省", None, "济源市", ())),
+        (("上海", None, "浦东新区"), ("上海市", None, "浦东新区", ())),
+        (("浙江省", "杭州市", "海曙区"), ("浙江省", "杭州市", None, ("county",))),
+    ],
+)
+def test_shipped_admin_divisions(shipped_data, given, expected):
+    assert shipped_data.has_cities
+    assert canonicalize_admin(*given) == expected
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""BudgetGovernor 减速 / 暂停 / 超出单任务预算测试"""
+
+import threading
+import time
+
+from budget_governor import BudgetGovernor
+
+
+def test_disabled_governor_passes_through():
+    governor = BudgetGovernor()
+    assert governor.before_request("big") == "big"
+
+
+def test_throttle_spaces_dispatch_across_threads():
+    governor = BudgetGovernor(task_budget=1000, throttle_seconds=0.1, fallback_model="small")
+    governor.start_task(1)
+    governor.record({"total_tokens": 850})
+    dispatched, models = [], []
+
+    def request():
+        models.append(governor.before_request("big"))
+        dispatched.append(time.monotonic())
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    t0 = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # 4 个线程共用一个派发时间表：第 1 个立即派发，之后每 0.1 秒一个
+    assert max(dispatched) - t0 >= 0.3
+    assert models == ["small"] * 4
+    assert governor.snapshot()["state"] == "throttle"
+
+
+def test_over_task_budget_keeps_dispatching_with_fallback():
+    governor = BudgetGovernor(task_budget=1000, throttle_seconds=0.0, fallback_model="small")
+    governor.start_task(1)
+    governor.record({"total_tokens": 1200})
+    assert [governor.before_request("big") for _ in range(3)] == ["small"] * 3
+    assert governor.snapshot()["state"] == "throttle"
+    governor.start_task(2)
+    assert governor.before_request("big") == "big"
+
+
+def test_paused_wait_stops_on_event():
+    governor = BudgetGovernor(hourly_budget=10)
+    governor.record({"total_tokens": 20})
+    stop = threading.Event()
+    threading.Timer(0.1, stop.set).start()
+    t0 = time.monotonic()
+    assert governor.before_request("big", stop) is None
+    assert time.monotonic() - t0 < 5
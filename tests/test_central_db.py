@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""central_db 地名索引行构造测试（不连库）"""
+
+import json
+
+from central_db import ADMIN_NAME_MAX, PLACE_NAME_MAX, build_place_index_rows
+
+
+def _result(poem_id, places):
+    return poem_id, json.dumps({"has_place": 1, "places": places}, ensure_ascii=False)
+
+
+def test_build_place_index_rows_cleans_and_dedups():
+    rows = build_place_index_rows(7, [
+        _result(1, [
+            {"name": "西湖", "modern_name": "西湖", "province": "浙江省", "city": "杭州市", "county": "未知"},
+            {"name": "西湖", "modern_name": "西湖", "province": "浙江省"},
+            {"name": "金陵", "modern_name": None, "province": "江苏省"},
+            {"name": "不确定"},
+            "西湖",
+        ]),
+        (2, "{\"error\":\"format_error\"}"),
+        (3, ","),
+    ])
+    assert rows == [
+        (1, 7, "西湖", "西湖", "浙江省", "杭州市", None),
+        (1, 7, "金陵", "", "江苏省", None, None),
+    ]
+
+
+def test_build_place_index_rows_skips_over_long_values():
+    rows = build_place_index_rows(7, [_result(1, [
+        {"name": "长" * (PLACE_NAME_MAX + 1), "modern_name": "x"},
+        {"name": "长安", "modern_name": "安" * (PLACE_NAME_MAX + 1), "province": "省" * (ADMIN_NAME_MAX + 1)},
+    ])])
+    assert rows == [(1, 7, "长安", "", None, None, None)]
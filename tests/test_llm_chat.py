@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""LLMChat 响应解析测试"""
+
+from types import SimpleNamespace
+
+import llm_chat
+from llm_chat import LLMChat
+
+USAGE = {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+
+
+def test_extract_completion_reads_dict_and_sdk_objects():
+    raw = {"choices": [{"message": {"content": "[]"}, "finish_reason": "stop"}], "usage": USAGE}
+    assert LLMChat.extract_completion(raw) == ("[]", "stop", USAGE)
+    sdk = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="[]"), finish_reason="length")],
+        usage=SimpleNamespace(**USAGE),
+    )
+    assert LLMChat.extract_completion(sdk) == ("[]", "length", USAGE)
+
+
+def test_extract_completion_keeps_usage_without_content():
+    raw = {"choices": [{"message": {"content": None}, "finish_reason": "length"}], "usage": USAGE}
+    assert LLMChat.extract_completion(raw) == ("", "length", USAGE)
+    assert LLMChat.extract_completion({"choices": [], "usage": USAGE}) == ("", None, USAGE)
+
+
+def test_ask_once_with_usage_reports_billed_usage_for_empty_content(monkeypatch):
+    # 不启动日志管线，避免测试在仓库目录下写 ask.log
+    monkeypatch.setattr(llm_chat, "setup_logging", lambda **kwargs: None)
+    chat = LLMChat()
+    monkeypatch.setattr(
+        chat,
+        "get_completion_once",
+        lambda *a: {"choices": [{"message": {"content": None}, "finish_reason": "length"}], "usage": USAGE},
+    )
+    response, usage = chat.ask_once_with_usage("q", "m")
+    assert response == ""
+    assert usage == {**USAGE, "finish_reason": "length"}
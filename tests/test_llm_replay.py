@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""llm_replay 录制文件解析测试"""
+
+import json
+
+from llm_replay import LLMReplayBackend, poems_from_recording, prompt_hash
+
+
+def _prompt(poems):
+    return "请提取地名：\n" + json.dumps({"poems": poems}, ensure_ascii=False)
+
+
+def test_poems_from_recording_skips_malformed_rows(tmp_path):
+    path = tmp_path / "record.jsonl"
+    rows = [
+        {"prompt": _prompt([{"id": 2, "content": "静夜思 唐 李白 床前明月光"}])},
+        {"prompt": _prompt([{"content": "缺少 id"}, {"id": None}, {"id": "x"}, "不是对象", {"id": "1", "content": "春晓 唐 孟浩然 春眠不觉晓"}])},
+        {"prompt": _prompt([{"id": 3, "content": "长诗 唐 某 第一段"}, {"id": 3, "content": "长诗 唐 某 第二段"}])},
+        {"prompt": 123},
+        "[]",
+    ]
+    path.write_text(
+        "\n".join(r if isinstance(r, str) else json.dumps(r, ensure_ascii=False) for r in rows) + "\n\nnot json\n",
+        encoding="utf-8",
+    )
+    assert poems_from_recording(str(path)) == [
+        (1, "春晓", "唐", "孟浩然", "春眠不觉晓"),
+        (2, "静夜思", "唐", "李白", "床前明月光"),
+    ]
+
+
+def test_replay_backend_rotates_and_counts_misses(tmp_path):
+    path = tmp_path / "record.jsonl"
+    entries = [
+        {"hash": prompt_hash("q", "m"), "response": "a", "finish_reason": "stop"},
+        {"hash": prompt_hash("q", "m"), "response": "b", "finish_reason": "stop"},
+    ]
+    path.write_text("\n".join(json.dumps(e) for e in entries) + "\n", encoding="utf-8")
+    backend = LLMReplayBackend(str(path))
+    contents = [backend.completion("q", "m")["choices"][0]["message"]["content"] for _ in range(3)]
+    assert contents == ["a", "b", "a"]
+    try:
+        backend.completion("q", "other")
+    except ValueError:
+        pass
+    assert (backend.hits, backend.misses) == (3, 1)
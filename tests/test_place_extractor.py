@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""place_extractor 长诗分段、分段合并与批量提取流程测试"""
+
+import json
+
+import place_extractor
+from place_extractor import (
+    MIN_SEGMENT_CHARS,
+    PoemSegment,
+    chunk_poems_by_chars,
+    merge_segment_results,
+    run_extraction,
+    segment_poem,
+)
+
+FORMAT_ERROR = '{"error":"format_error"}'
+
+
+def _lines(n, width=40):
+    # 每行内容互不相同，便于定位窗口边界
+    return [f"{i:02d}" + "山" * (width - 3) + "。" for i in range(n)]
+
+
+def test_segment_poem_hard_cuts_single_long_line():
+    content = "江" * (MIN_SEGMENT_CHARS * 3 + 7)
+    segments = segment_poem((1, "长歌", "唐", "某", content), max_chars=0, overlap_lines=2)
+    assert len(segments) == 4
+    assert all(len(s.content) <= MIN_SEGMENT_CHARS for s in segments)
+    # 硬切出的每一行独占一个窗口，不产生重叠
+    assert "".join(s.content for s in segments) == content
+    assert [s.seg_index for s in segments] == [0, 1, 2, 3]
+    assert all(isinstance(s, PoemSegment) and s[:4] == (1, "长歌", "唐", "某") for s in segments)
+
+
+def test_segment_poem_caps_overlap_at_half_window():
+    lines = _lines(10)
+    segments = segment_poem((1, "t", "唐", "a", "".join(lines)), max_chars=0, overlap_lines=5)
+    windows = [[line for line in lines if line in s.content] for s in segments]
+    assert windows[0] == lines[:2]  # 窗口预算 MIN_SEGMENT_CHARS，每窗 2 行
+    for prev, cur in zip(windows, windows[1:]):
+        overlap = min(5, len(prev) // 2)
+        assert cur[:overlap] == prev[len(prev) - overlap:]
+        assert cur[overlap] == lines[lines.index(prev[-1]) + 1]
+    assert windows[-1][-1] == lines[-1]
+    assert len(segments) == 9
+
+
+def test_segment_poem_short_or_empty_content_is_single_window():
+    assert segment_poem((1, "t", "唐", "a", ""), max_chars=0) == [PoemSegment(1, "t", "唐", "a", "", 0)]
+    assert len(segment_poem((1, "t", "唐", "a", "白日依山尽。"), max_chars=1000)) == 1
+
+
+def test_chunk_poems_by_chars_segments_only_when_enabled():
+    long_poem = (2, "t", "唐", "a", "".join(_lines(10)))
+    poems = [(1, "t", "唐", "a", "床前明月光。"), long_poem, (3, "t", "唐", "a", "春眠不觉晓。")]
+    plain = chunk_poems_by_chars(poems, max_chars=200, max_items=10)
+    assert [[int(p[0]) for p in b] for b in plain] == [[1], [2], [3]]
+    segmented = chunk_poems_by_chars(poems, max_chars=200, max_items=10, segment_long_poems=True)
+    assert [int(b[0][0]) for b in segmented] == [1] + [2] * (len(segmented) - 2) + [3]
+    assert all(len(b) == 1 and isinstance(b[0], PoemSegment) for b in segmented[1:-1])
+
+
+def test_merge_segment_results_dedups_and_fills_fields():
+    merged = json.loads(merge_segment_results([
+        json.dumps({"has_place": 1, "places": [{"name": "长安", "modern_name": "西安", "province": None}]}),
+        json.dumps({"has_place": 0, "places": []}),
+        json.dumps({"has_place": 1, "places": [
+            {"name": "长安", "modern_name": "西安", "province": "陕西省"},
+            {"name": "洛阳", "modern_name": "洛阳", "province": "河南省"},
+        ]}),
+    ]))
+    assert merged["has_place"] == 1
+    assert merged["places"] == [
+        {"name": "长安", "modern_name": "西安", "province": "陕西省"},
+        {"name": "洛阳", "modern_name": "洛阳", "province": "河南省"},
+    ]
+
+
+def test_merge_segment_results_fails_whole_poem_on_bad_segment():
+    ok = json.dumps({"has_place": 1, "places": [{"name": "长安"}]})
+    assert merge_segment_results([ok, FORMAT_ERROR]) == FORMAT_ERROR
+    assert merge_segment_results([ok, "not json"]) == FORMAT_ERROR
+
+
+def test_run_extraction_fails_poem_when_a_segment_never_succeeds(monkeypatch):
+    def fake_request(batch, *args):
+        if isinstance(batch[0], PoemSegment) and batch[0].seg_index == 1:
+            return {}, {"finish_reason": "stop"}, {}
+        place = {"name": f"地{int(batch[0][0])}"}
+        return {int(p[0]): json.dumps({"has_place": 1, "places": [place]}) for p in batch}, {}, {}
+
+    monkeypatch.setattr(place_extractor, "analyze_poems_batch_request", fake_request)
+    poems = [(1, "t", "唐", "a", "床前明月光。"), (2, "t", "唐", "a", "".join(_lines(10)))]
+    results, interrupted = run_extraction(
+        poems, "m", max_chars_per_batch=200, max_retries=1, task_timeout=None, segment_long_poems=True
+    )
+    assert not interrupted
+    assert results[0][1] != FORMAT_ERROR
+    assert results[1] == (2, FORMAT_ERROR)
+
+
+def _retry_calls(monkeypatch, finish_reason):
+    calls = []
+
+    def fake_request(batch, *args):
+        ids = [int(p[0]) for p in batch]
+        calls.append(ids)
+        returned = ids if len(calls) > 1 else ids[:1]  # 首次只返回第一首
+        return {pid: '{"has_place":0,"places":[]}' for pid in returned}, {"finish_reason": finish_reason}, {}
+
+    monkeypatch.setattr(place_extractor, "analyze_poems_batch_request", fake_request)
+    poems = [(i, "t", "唐", "a", "床前明月光。") for i in range(1, 6)]
+    results, _ = run_extraction(poems, "m", max_workers=1, max_retries=1, task_timeout=None)
+    assert all(m != FORMAT_ERROR for _, m in results)
+    return calls
+
+
+def test_truncated_batch_resubmits_missing_poems_in_halves(monkeypatch):
+    calls = _retry_calls(monkeypatch, "length")
+    assert calls[0] == [1, 2, 3, 4, 5]
+    assert sorted(calls[1:]) == [[2, 3], [4, 5]]
+
+
+def test_failed_batch_is_retried_whole(monkeypatch):
+    assert _retry_calls(monkeypatch, "stop") == [[1, 2, 3, 4, 5], [1, 2, 3, 4, 5]]
+
+
+def test_iter_completed_drops_batches_past_drain_deadline():
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from place_extractor import _iter_completed
+
+    stop = threading.Event()
+    release = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1)
+    futures = {executor.submit(time.sleep, 0.05): "fast", executor.submit(release.wait, 5): "slow"}
+    futures[executor.submit(time.sleep, 0)] = "queued"
+    threading.Timer(0.2, stop.set).start()
+    t0 = time.monotonic()
+    done = [futures[f] for f in _iter_completed(futures, stop, drain_timeout=0.3)]
+    assert done == ["fast"]
+    assert 0.4 <= time.monotonic() - t0 < 2
+    assert [f for f, name in futures.items() if name == "queued"][0].cancelled()
+    release.set()
+    executor.shutdown()
+
+
+def _slow_request(delay):
+    def fake_request(batch, *args):
+        shutdown_event = args[-1]
+        if shutdown_event is not None and shutdown_event.wait(delay):
+            return {}, {}, {}
+        return {int(p[0]): '{"has_place":0,"places":[]}' for p in batch}, {}, {}
+    return fake_request
+
+
+def test_run_extraction_reports_interruption(monkeypatch):
+    import threading
+
+    monkeypatch.setattr(place_extractor, "analyze_poems_batch_request", _slow_request(0.2))
+    poems = [(i, "t", "唐", "a", "床前明月光。") for i in range(1, 5)]
+    stop = threading.Event()
+    threading.Timer(0.05, stop.set).start()
+    results, interrupted = run_extraction(
+        poems, "m", max_items_per_batch=2, max_workers=1, task_timeout=None, shutdown_event=stop, drain_timeout=1
+    )
+    assert interrupted
+    assert all(m == FORMAT_ERROR for _, m in results)
+
+
+def test_failures_and_late_signal_are_not_interruptions(monkeypatch):
+    import threading
+
+    monkeypatch.setattr(place_extractor, "analyze_poems_batch_request", lambda batch, *a: ({}, {}, {}))
+    poems = [(1, "t", "唐", "a", "床前明月光。")]
+    results, interrupted = run_extraction(poems, "m", max_retries=1, task_timeout=None, shutdown_event=threading.Event())
+    assert (results, interrupted) == ([(1, FORMAT_ERROR)], False)
+
+    monkeypatch.setattr(place_extractor, "analyze_poems_batch_request", _slow_request(0))
+    stop = threading.Event()
+    results, interrupted = run_extraction(poems, "m", task_timeout=None, shutdown_event=stop)
+    stop.set()  # 全部完成后才收到信号
+    assert not interrupted and results[0][1] != FORMAT_ERROR
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""worker 任务处理与停止信号测试（中央服务器 / 数据库 / LLM 均打桩）"""
+
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+import worker
+
+FORMAT_ERROR = '{"error":"format_error"}'
+OK = '{"has_place":0,"places":[]}'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _stub_task(monkeypatch, results, interrupted):
+    calls = {"inserted": None, "completed": []}
+    monkeypatch.setattr(worker, "claim_task", lambda: (True, 9, [1, 2, 3], ""))
+    monkeypatch.setattr(worker, "get_poems_by_ids", lambda ids: [(i, "t", "唐", "a", "x") for i in ids])
+    monkeypatch.setattr(worker, "run_extraction", lambda *a, **k: (results, interrupted))
+    monkeypatch.setattr(worker, "insert_match_results", lambda task_id, rows: calls.update(inserted=rows))
+    monkeypatch.setattr(worker, "complete_task", lambda task_id: calls["completed"].append(task_id) or (True, "ok"))
+    monkeypatch.setattr(worker, "PLACE_INDEX_ENABLED", False)
+    return calls
+
+
+def test_interrupted_task_writes_finished_poems_and_completes(monkeypatch, caplog):
+    calls = _stub_task(monkeypatch, [(1, OK), (2, FORMAT_ERROR), (3, FORMAT_ERROR)], True)
+    assert worker.process_one_task() is True
+    assert calls["inserted"] == [(1, OK)]
+    assert calls["completed"] == [9]
+    assert "未处理 poem_id: [2, 3]" in caplog.text
+
+
+def test_format_errors_without_interruption_are_failures(monkeypatch, caplog):
+    calls = _stub_task(monkeypatch, [(1, OK), (2, FORMAT_ERROR), (3, OK)], False)
+    assert worker.process_one_task() is True
+    assert calls["inserted"] == [(1, OK), (3, OK)]
+    assert calls["completed"] == [9]
+    assert "未处理" not in caplog.text
+    assert "format_error 视为失败" in caplog.text
+
+
+_SLOW_WORKER = textwrap.dedent("""
+    import os, signal, sys, threading, time
+    sys.path.insert(0, {root!r})
+    import place_extractor, worker
+
+    claims = []
+    def claim_task():
+        claims.append(1)
+        return (True, 1, [1, 2], "") if len(claims) == 1 else (False, None, None, "无任务")
+
+    def slow_request(batch, *args):
+        time.sleep(30)  # 模拟不响应停止信号的 HTTP 读超时
+        return {{}}, {{}}, {{}}
+
+    worker.claim_task = claim_task
+    worker.health_check = lambda: (True, "ok")
+    worker.get_poems_by_ids = lambda ids: [(i, "t", "唐", "a", "床前明月光。") for i in ids]
+    worker.insert_match_results = lambda *a: None
+    def complete_task(task_id):
+        with open("completed", "w") as f:
+            f.write(str(task_id))
+        return True, "ok"
+
+    worker.complete_task = complete_task
+    worker.PLACE_INDEX_ENABLED = False
+    worker.SHUTDOWN_GRACE_SECONDS = 1
+    place_extractor.analyze_poems_batch_request = slow_request
+    threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGTERM)).start()
+    worker.main()
+""")
+
+
+def test_worker_exits_within_grace_period_despite_hung_request(tmp_path):
+    t0 = time.monotonic()
+    proc = subprocess.run(
+        [sys.executable, "-c", _SLOW_WORKER.format(root=ROOT)],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    elapsed = time.monotonic() - t0
+    assert proc.returncode == 0, proc.stderr
+    assert (tmp_path / "completed").read_text() == "1"
+    assert elapsed < 10
@@ -5,7 +5,8 @@
 """
 
 import os
-import time
+import signal
+import threading
 import logging
 
 from config import (
@@ -18,23 +19,43 @@ from config import (
     MAX_CHARS_PER_BATCH,
     MAX_ITEMS_PER_BATCH,
     MAX_RETRIES,
+    SEGMENT_LONG_POEMS,
+    SEGMENT_OVERLAP_LINES,
+    VALIDATE_PLACES,
+    PLACE_INDEX_ENABLED,
     POLL_INTERVAL,
+    SHUTDOWN_GRACE_SECONDS,
 )
+from budget_governor import BudgetGovernor
 from task_client import claim_task, complete_task, health_check
-from central_db import get_poems_by_ids, insert_match_results
+from central_db import get_poems_by_ids, insert_match_results, insert_place_index
 from place_extractor import run_extraction
+from llm_chat import get_llm_settings
+from logging_setup import setup_logging, shutdown_logging
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 logger = logging.getLogger(__name__)
 
+# 收到 SIGTERM/SIGINT 后置位：停止领取新任务，当前任务排空后退出
+shutdown_event = threading.Event()
+
+
+def _handle_shutdown_signal(signum, frame):
+    if shutdown_event.is_set():
+        # 第二次信号：不再等待，直接中断
+        raise KeyboardInterrupt
+    logger.info(
+        "收到信号 %s，停止领取新任务，等待进行中的批次完成（最多 %s 秒）",
+        signal.Signals(signum).name, SHUTDOWN_GRACE_SECONDS,
+    )
+    shutdown_event.set()
+
 
-def process_one_task():
+def process_one_task(llm_settings=None, governor=None):
     """
     领取一个任务、拉诗、提取地名、写库、上报完成。
+    llm_settings: 启动时解析好的 LLM 配置，透传给 run_extraction。
+    governor: 进程级 token 预算调控器，每个任务开始时重置单任务用量。
+    提取被停止信号截断时，写入已完成的结果后照常上报完成，未处理的诗与 format_error 一样不写结果，并记录其 id。
     返回: True 表示处理了一个任务，False 表示没有可领任务或出错。
     """
     ok, task_id, poem_ids, msg = claim_task()
@@ -57,8 +78,10 @@ def process_one_task():
         logger.info("上报完成: success=%s, message=%s", ok2, msg2)
         return True
 
+    if governor is not None:
+        governor.start_task(task_id)
     try:
-        results = run_extraction(
+        results, interrupted = run_extraction(
             poems,
             model=DEFAULT_MODEL,
             prompt_id=PROMPT_ID,
@@ -67,25 +90,50 @@ def process_one_task():
             max_chars_per_batch=MAX_CHARS_PER_BATCH,
             max_items_per_batch=MAX_ITEMS_PER_BATCH,
             max_retries=MAX_RETRIES,
+            segment_long_poems=SEGMENT_LONG_POEMS,
+            segment_overlap_lines=SEGMENT_OVERLAP_LINES,
+            llm_settings=llm_settings,
+            validate_places=VALIDATE_PLACES,
+            shutdown_event=shutdown_event,
+            drain_timeout=SHUTDOWN_GRACE_SECONDS,
+            governor=governor,
         )
     except Exception as e:
         logger.exception("地名提取失败 task_id=%s: %s", task_id, e)
         # 不写库、不上报完成，任务会一直 in_progress；也可选择写入失败记录后上报 failed，此处简单处理为不完成
         return True  # 避免死循环重试同一任务
+    if governor is not None:
+        logger.info("任务 task_id=%s token 用量与预算调控指标: %s", task_id, governor.snapshot())
 
     # 过滤 format_error：不写入数据库，视为失败并记录日志
     FORMAT_ERROR = '{"error":"format_error"}'
     success_results = []
+    unfinished = []
     for poem_id, match_names in results:
-        if match_names == FORMAT_ERROR:
-            logger.warning("format_error 视为失败，不写入数据库: task_id=%s poem_id=%s", task_id, poem_id)
-        else:
+        if match_names != FORMAT_ERROR:
             success_results.append((poem_id, match_names))
+        elif interrupted:
+            unfinished.append(poem_id)
+        else:
+            logger.warning("format_error 视为失败，不写入数据库: task_id=%s poem_id=%s", task_id, poem_id)
 
     # 写入中央库 place_names_match_results（仅成功结果）
     insert_match_results(task_id, success_results)
     logger.info("任务 task_id=%s 已写入 %s 条结果", task_id, len(success_results))
+    if PLACE_INDEX_ENABLED:
+        # 索引表是 match_names 的派生数据，写失败不影响任务完成
+        try:
+            n = insert_place_index(task_id, success_results)
+            logger.info("任务 task_id=%s 已写入 %s 条地名索引", task_id, n)
+        except Exception as e:
+            logger.exception("写入地名索引失败 task_id=%s: %s", task_id, e)
 
+    if unfinished:
+        # 中央服务器没有部分完成接口，未上报完成的任务会一直 in_progress：已完成的结果已写库，照常上报，
+        # 未处理的诗不写结果（同 format_error），记录 id 供重新下发
+        logger.warning(
+            "任务 task_id=%s 因停止信号未处理 %s 条，仍上报完成，未处理 poem_id: %s", task_id, len(unfinished), unfinished
+        )
     ok2, msg2 = complete_task(task_id)
     if not ok2:
         logger.error("上报完成失败 task_id=%s: %s", task_id, msg2)
@@ -95,35 +143,51 @@ def process_one_task():
 
 
 def main():
+    setup_logging()
     logger.info("Worker 启动，中央服务器: %s，LLM 平台: %s", CENTRAL_API_BASE_URL, LLM_PLATFORM)
-    platform = (LLM_PLATFORM or "siliconflow").lower().strip()
-    if platform == "siliconflow" and not (os.getenv("SILICONFLOW_API_KEY") or "").strip():
+    llm_settings = get_llm_settings()
+    platform = llm_settings.platform
+    if platform == "siliconflow" and not llm_settings.api_key:
         logger.warning(
             "SILICONFLOW_API_KEY 未设置，SiliconFlow 调用将失败。"
             "请在 .env 中设置 SILICONFLOW_API_KEY 或改用 LLM_PLATFORM=aliyun/openrouter"
         )
-    elif platform == "aliyun" and not (os.getenv("DASHSCOPE_API_KEY") or "").strip():
+    elif platform == "aliyun" and not llm_settings.api_key:
         logger.warning("LLM_PLATFORM=aliyun 但 DASHSCOPE_API_KEY 未设置，请在 .env 中配置。")
-    elif platform == "openrouter" and not (os.getenv("OPENROUTER_API_KEY") or os.getenv("OPEN_ROUTER_KEY") or "").strip():
+    elif platform == "openrouter" and not llm_settings.api_key:
         logger.warning("LLM_PLATFORM=openrouter 但 OPENROUTER_API_KEY 未设置，请在 .env 中配置。")
+    governor = BudgetGovernor.from_config()
+    if governor.enabled:
+        logger.info(
+            "Token 预算: 单任务 %s, 每小时 %s, 调控阈值 %s, 备用模型 %s",
+            governor.task_budget, governor.hourly_budget, governor.soft_ratio, governor.fallback_model or "无",
+        )
     ok, msg = health_check()
     if not ok:
         logger.warning("中央服务器健康检查失败: %s，将继续尝试领取任务", msg)
     else:
         logger.info("中央服务器健康检查: %s", msg)
 
-    while True:
+    signal.signal(signal.SIGTERM, _handle_shutdown_signal)
+    signal.signal(signal.SIGINT, _handle_shutdown_signal)
+
+    while not shutdown_event.is_set():
         try:
-            processed = process_one_task()
+            processed = process_one_task(llm_settings, governor)
             if not processed:
                 logger.info("暂无任务，%s 秒后重试", POLL_INTERVAL)
-                time.sleep(POLL_INTERVAL)
+                shutdown_event.wait(POLL_INTERVAL)
         except KeyboardInterrupt:
             logger.info("收到中断，退出")
             break
         except Exception as e:
             logger.exception("单轮异常: %s", e)
-            time.sleep(POLL_INTERVAL)
+            shutdown_event.wait(POLL_INTERVAL)
+    logger.info("Worker 已停止")
+    # 超出 drain 期限仍在等待 LLM 响应的线程会在解释器退出时被 concurrent.futures join（最长为 HTTP 超时加重试），
+    # 结果已写库并上报，写完日志后直接结束进程
+    shutdown_logging()
+    os._exit(0)
 
 
 if __name__ == "__main__":